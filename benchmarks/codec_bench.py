@@ -0,0 +1,48 @@
+"""
+Сравнение JSON и двоичного формата (common.codec) на типичных
+сообщениях протокола: размер кадра и время кодирования и разбора.
+
+Запуск из корня проекта: python benchmarks/codec_bench.py
+"""
+import base64
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.variables import *
+from common.utils import FrameDecoder, encode_message
+
+# Шифротекст RSA 2048 бит, как у клиента
+CIPHERTEXT = base64.b64encode(os.urandom(256)).decode('ascii')
+
+SAMPLES = {
+    'message': {ACTION: MESSAGE, SENDER: 'user_one', DESTINATION: 'user_two',
+                TIME: time.time(), MESSAGE_TEXT: CIPHERTEXT},
+    'presence': {ACTION: PRESENCE, TIME: time.time(),
+                 USER: {ACCOUNT_NAME: 'user_one', PUBLIC_KEY: 'k' * 450},
+                 CAPABILITIES: [CAP_BINARY]},
+    'response_200': {RESPONSE: 200},
+    'users_202': {RESPONSE: 202, LIST_INFO: [f'user_{number}' for number in range(100)]},
+}
+
+
+def measure(message, binary, number):
+    frame = encode_message(message, binary=binary)
+    decoder = FrameDecoder()
+    encode_time = timeit.timeit(lambda: encode_message(message, binary=binary), number=number)
+    decode_time = timeit.timeit(lambda: decoder.feed(frame), number=number)
+    return len(frame), encode_time / number * 1e6, decode_time / number * 1e6
+
+
+def main(number=20000):
+    print(f'{"сообщение":<14}{"формат":<8}{"байт":>7}{"кодир., мкс":>14}{"разбор, мкс":>14}')
+    for name, message in SAMPLES.items():
+        for binary in (False, True):
+            size, encode_us, decode_us = measure(message, binary, number)
+            print(f'{name:<14}{"binary" if binary else "json":<8}{size:>7}{encode_us:>14.2f}{decode_us:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
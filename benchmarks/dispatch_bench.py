@@ -0,0 +1,137 @@
+"""
+Стоимость разбора одного сообщения в MessageProcessor.
+
+Первая таблица - выбор обработчика и проверка сообщения: прежняя цепочка
+if/elif из process_client_message (воспроизведена ниже) против таблицы
+обработчиков server.dispatch. Вторая - полный вызов process_client_message
+с ответом в исходящую очередь. Берутся сообщения, обработка которых не
+обращается к базе данных.
+
+Запуск из корня проекта: python benchmarks/dispatch_bench.py
+"""
+import logging
+import os
+import socket
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.variables import *
+from server.core import MessageProcessor
+from server.outbound import OutboundQueue
+
+
+class NullSocket(socket.socket):
+    """Сокет, принимающий всё без задержки."""
+    def send(self, data, flags=0):
+        return len(data)
+
+
+SAMPLES = {
+    # Сообщение пользователю - второе условие цепочки
+    'message': {ACTION: MESSAGE, TIME: 1.1, SENDER: 'user_0', DESTINATION: 'user_1',
+                MESSAGE_TEXT: 'text'},
+    # Подтверждение без ожидаемой пачки
+    'ack': {ACTION: ACK, TIME: 1.1, USER: 'user_0', MESSAGE_ID: 0},
+    # Сообщение в комнату из кэша участников, рассылка трём клиентам
+    'room_message': {ACTION: ROOM_MESSAGE, TIME: 1.1, SENDER: 'user_0', ROOM: 'room',
+                     MESSAGE_TEXT: 'text'},
+    # Запрос ключа - последнее условие цепочки
+    'pubkey_need': {ACTION: PUBLIC_KEY_REQUEST, TIME: 1.1, ACCOUNT_NAME: 'user_1'},
+    # Неизвестное действие - проверяются все условия
+    'bad_request': {ACTION: 'unknown', TIME: 1.1, USER: 'user_0'},
+}
+
+
+def chain_dispatch(names, message, client):
+    """Условия прежней цепочки if/elif, возвращает номер ветки."""
+    if ACTION in message and message[ACTION] == PRESENCE and TIME in message and USER in message:
+        return 0
+    elif ACTION in message and message[ACTION] == MESSAGE and DESTINATION in message and TIME in message \
+            and SENDER in message and MESSAGE_TEXT in message and names[message[SENDER]] == client:
+        return 1
+    elif ACTION in message and message[ACTION] == ACK and MESSAGE_ID in message and USER in message \
+            and names[message[USER]] == client:
+        return 2
+    elif ACTION in message and message[ACTION] == ROOM_MESSAGE and ROOM in message and TIME in message \
+            and SENDER in message and MESSAGE_TEXT in message and names[message[SENDER]] == client:
+        return 3
+    elif ACTION in message and message[ACTION] == ROOM_CREATE and ROOM in message and USER in message \
+            and names[message[USER]] == client:
+        return 4
+    elif ACTION in message and message[ACTION] == ROOM_JOIN and ROOM in message and USER in message \
+            and names[message[USER]] == client:
+        return 5
+    elif ACTION in message and message[ACTION] == ROOM_LEAVE and ROOM in message and USER in message \
+            and names[message[USER]] == client:
+        return 6
+    elif ACTION in message and message[ACTION] == ROOMS_REQUEST and USER in message \
+            and names[message[USER]] == client:
+        return 7
+    elif ACTION in message and message[ACTION] == EXIT and ACCOUNT_NAME in message \
+            and names[message[ACCOUNT_NAME]] == client:
+        return 8
+    elif ACTION in message and message[ACTION] == GET_CONTACTS and USER in message and \
+            names[message[USER]] == client:
+        return 9
+    elif ACTION in message and message[ACTION] == ADD_CONTACT and ACCOUNT_NAME in message and USER in message \
+            and names[message[USER]] == client:
+        return 10
+    elif ACTION in message and message[ACTION] == REMOVE_CONTACT and ACCOUNT_NAME in message and USER in message \
+            and names[message[USER]] == client:
+        return 11
+    elif ACTION in message and message[ACTION] == USERS_REQUEST and ACCOUNT_NAME in message \
+            and names[message[ACCOUNT_NAME]] == client:
+        return 12
+    elif ACTION in message and message[ACTION] == SYNC and VERSION in message and USER in message \
+            and names[message[USER]] == client:
+        return 13
+    elif ACTION in message and message[ACTION] == PUBLIC_KEY_REQUEST and ACCOUNT_NAME in message:
+        return 14
+    return None
+
+
+def table_dispatch(handlers, names, message, client):
+    """Выбор обработчика по таблице, как в process_client_message."""
+    entry = handlers.get(message.get(ACTION))
+    if entry is None or not entry[0](names, message, client):
+        return None
+    return entry[1]
+
+
+def make_server(users):
+    server = MessageProcessor('127.0.0.1', 7777, None)
+    clients = []
+    for number in range(users):
+        client = NullSocket()
+        server.names.connect(client, ('127.0.0.1', 7777))
+        server.names.login(client, f'user_{number}')
+        server.outbound[client] = OutboundQueue(('127.0.0.1', 7777))
+        clients.append(client)
+    server.rooms['room'] = frozenset(('user_0', 'user_1', 'user_2'))
+    return server, clients[0]
+
+
+def main(number=200000, users=100):
+    logging.disable(logging.CRITICAL)
+    server, client = make_server(users)
+    names, handlers = server.names.users, server.handlers
+
+    print('Выбор обработчика, нс на сообщение')
+    print(f'{"сообщение":<16}{"if/elif":>10}{"таблица":>10}')
+    for name, message in SAMPLES.items():
+        chain = timeit.timeit(lambda: chain_dispatch(names, message, client), number=number)
+        table = timeit.timeit(lambda: table_dispatch(handlers, names, message, client), number=number)
+        print(f'{name:<16}{chain / number * 1e9:>10.0f}{table / number * 1e9:>10.0f}')
+
+    print()
+    print('Полный разбор process_client_message, мкс на сообщение')
+    for name in ('ack', 'room_message', 'bad_request'):
+        message = SAMPLES[name]
+        elapsed = timeit.timeit(
+            lambda: server.process_client_message(dict(message), client), number=number // 10)
+        print(f'{name:<16}{elapsed / (number // 10) * 1e6:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
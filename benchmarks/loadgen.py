@@ -0,0 +1,441 @@
+"""
+Генератор нагрузки: пропускная способность и задержка доставки сервера.
+
+Регистрирует пользователей load_0 ... load_N-1 прямо в ServerDB (и, для
+сценария rooms, комнаты), запускает сервер без GUI в отдельном процессе
+(или подключается к уже запущенному, --connect), открывает N соединений
+клиентами client.async_core.AsyncClient с настоящей авторизацией и
+ведёт трафик по одному из сценариев:
+
+- pairwise - пользователи разбиты на пары и пишут друг другу;
+- hot - доля --hot-share сообщений уходит одному пользователю load_0,
+  остальные - случайным;
+- rooms - пользователи разбиты на комнаты по --room-size человек и
+  пишут в свою комнату;
+- churn - пользователи добавляют и удаляют контакты, сообщений нет;
+- logins - пользователи отключаются и входят заново (--rate входов в
+  секунду на клиента, следующий вход - не раньше завершения прошлого),
+  задержка запроса - время от подключения до ответа 200 на авторизацию.
+
+Каждый клиент отправляет --rate запросов в секунду по расписанию, не
+дожидаясь ответов на предыдущие (задержка сервера не снижает нагрузку).
+Задержка доставки считается от поля TIME сообщения до приёма
+получателем, задержка запроса - от отправки до ответа. Первые --warmup
+секунд не учитываются. Сервер измеряется по /proc: процессорное время
+(вместе с дочерними процессами) и наибольший RSS за время замера.
+
+Результаты воспроизводимы: трафик задаётся --seed, все параметры
+печатаются вместе с результатами и сохраняются в --json.
+
+Только Linux. Запуск из корня проекта: python benchmarks/loadgen.py --users 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from client.async_core import AsyncClient
+from client.core import password_hash
+from common.metrics import Histogram
+from common.variables import *
+from errors import ServerError
+
+PASSWORD = 'load'
+PATTERNS = ('pairwise', 'hot', 'rooms', 'churn', 'logins')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description='Генератор нагрузки сервера мессенджера.')
+    parser.add_argument('--users', type=int, default=200, help='число подключений')
+    parser.add_argument('--pattern', choices=PATTERNS, default='pairwise')
+    parser.add_argument('--rate', type=float, default=2, help='запросов в секунду от одного клиента')
+    parser.add_argument('--duration', type=float, default=20, help='длительность замера, секунд')
+    parser.add_argument('--warmup', type=float, default=3, help='разогрев без учёта, секунд')
+    parser.add_argument('--hot-share', type=float, default=0.5, help='доля сообщений горячему пользователю')
+    parser.add_argument('--room-size', type=int, default=10)
+    parser.add_argument('--size', type=int, default=64, help='длина текста сообщения')
+    parser.add_argument('--processes', type=int, default=1, help='процессов с клиентами')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--engine', choices=('select', 'asyncio'), default='select')
+    parser.add_argument('--workers', type=int, default=1, help='процессов сервера (кластер)')
+    parser.add_argument('--port', type=int, default=17950)
+    parser.add_argument('--database', help='файл базы сервера (по умолчанию - временный)')
+    parser.add_argument('--connect', metavar='ADDRESS:PORT',
+                        help='подключиться к запущенному серверу вместо запуска своего')
+    parser.add_argument('--server-pid', type=int, help='pid запущенного сервера для замера CPU и RSS')
+    parser.add_argument('--json', help='сохранить параметры и результаты в файл')
+    return parser
+
+
+def user_name(number):
+    return f'load_{number}'
+
+
+def room_name(number):
+    return f'load_room_{number}'
+
+
+def register(database_file, users, pattern, room_size):
+    """
+    Регистрирует недостающих пользователей и комнаты в базе сервера.
+    Хэши паролей считаются параллельно во всех ядрах.
+    @return: {имя: хэш пароля}
+    """
+    from server.server_db import ServerDB
+    names = [user_name(number) for number in range(users)]
+    with ProcessPoolExecutor() as pool:
+        hashes = dict(zip(names, pool.map(password_hash, names, [PASSWORD] * users, chunksize=64)))
+    database = ServerDB(database_file, clear_active=False)
+    for name in names:
+        if not database.check_user(name):
+            database.add_user(name, hashes[name])
+    if pattern == 'rooms':
+        for start in range(0, users, room_size):
+            room = room_name(start // room_size)
+            database.create_room(room, names[start])
+            for name in names[start + 1:start + room_size]:
+                database.join_room(room, name)
+    return hashes
+
+
+def serve(engine, workers, address, port, database_file):
+    """Точка входа процесса сервера без GUI."""
+    from server.core import MessageProcessor
+    from server.async_core import AsyncMessageProcessor
+    from server.cluster import ClusterSupervisor
+    from server.server_db import ServerDB
+    # Предупреждения о медленных клиентах при перегрузке не нужны
+    logging.disable(logging.WARNING)
+    engine = {'select': MessageProcessor, 'asyncio': AsyncMessageProcessor}[engine]
+    database = ServerDB(database_file)
+    if workers > 1:
+        server = ClusterSupervisor(engine, workers, address, port, database_file, {})
+    else:
+        server = engine(address, port, database, {})
+        server.daemon = True
+    # SIGTERM завершает процесс штатно, вместе с воркерами кластера
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    finally:
+        server.stop()
+        if workers == 1:
+            server.join()
+
+
+def wait_port(address, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((address, port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Сервер не слушает порт {port}.')
+
+
+def process_tree(pid):
+    """pid процесса и всех его потомков."""
+    parents = dict()
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as file:
+                    parents.setdefault(int(file.read().rsplit(')', 1)[1].split()[1]), []).append(int(entry))
+            except OSError:
+                continue
+    tree = [pid]
+    for current in tree:
+        tree.extend(parents.get(current, ()))
+    return tree
+
+
+def server_usage(pid):
+    """Процессорное время (секунд) и RSS (байт) процесса вместе с потомками."""
+    cpu = rss = 0
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/stat') as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # utime и stime - 14 и 15 поля stat, rss - 24 (в страницах)
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        rss += int(fields[21]) * PAGE_SIZE
+    return cpu, rss
+
+
+class LoadClient:
+    """Один клиент нагрузки и его расписание отправки."""
+
+    def __init__(self, config, number, passwd_hash, latency, rtt, counters):
+        self.config = config
+        self.number = number
+        self.name = user_name(number)
+        self.passwd_hash = passwd_hash
+        self.random = random.Random(config['seed'] * 1000003 + number)
+        self.latency = latency
+        self.rtt = rtt
+        self.counters = counters
+        self.contact = None
+        # Запросы, ответ на которые ещё не пришёл
+        self.outstanding = set()
+        self.client = self.new_client()
+
+    def new_client(self):
+        return AsyncClient(self.config['address'], self.config['port'], self.name, PASSWORD,
+                           passwd_hash=self.passwd_hash, on_message=self.received)
+
+    def received(self, message):
+        sent = message[TIME]
+        if sent < self.config['measure_from']:
+            return
+        self.counters['delivered'] += 1
+        self.latency.record(max(0, int((time.time() - sent) * 1e9)))
+
+    def next_request(self):
+        config = self.config
+        users = config['users']
+        text = 'x' * config['size']
+        pattern = config['pattern']
+        if pattern == 'pairwise':
+            return self.client.message_request(user_name(self.number ^ 1), text)
+        if pattern == 'hot':
+            if self.number and self.random.random() < config['hot_share']:
+                return self.client.message_request(user_name(0), text)
+            return self.client.message_request(user_name(self.random.randrange(users)), text)
+        if pattern == 'rooms':
+            return self.client.room_message_request(room_name(self.number // config['room_size']), text)
+        # churn: добавить случайный контакт, следующим запросом - удалить
+        if self.contact is None:
+            self.contact = user_name(self.random.randrange(users))
+            return self.client.contact_request(ADD_CONTACT, self.contact)
+        contact, self.contact = self.contact, None
+        return self.client.contact_request(REMOVE_CONTACT, contact)
+
+    def answered(self, start, measured, future):
+        self.outstanding.discard(future)
+        if future.cancelled() or future.exception() is not None \
+                or future.result().get(RESPONSE) != 200:
+            self.counters['errors'] += 1
+        elif measured:
+            self.rtt.record(time.perf_counter_ns() - start)
+
+    async def relogin(self, measured):
+        '''Выход и новый вход тем же пользователем по новому соединению.'''
+        await self.client.close()
+        self.client = self.new_client()
+        start = time.perf_counter_ns()
+        try:
+            await self.client.login()
+        except (OSError, ServerError):
+            self.counters['errors'] += 1
+            return
+        if measured:
+            self.counters['sent'] += 1
+            self.rtt.record(time.perf_counter_ns() - start)
+
+    async def run(self, start_at, stop_at):
+        interval = 1 / self.config['rate']
+        logins = self.config['pattern'] == 'logins'
+        # Случайная фаза разносит отправки клиентов внутри интервала
+        next_at = start_at + self.random.uniform(0, interval)
+        while next_at < stop_at and (self.client.running or logins):
+            await asyncio.sleep(max(0, next_at - time.time()))
+            measured = next_at >= self.config['measure_from']
+            if logins:
+                # Неудачный вход не останавливает клиента. Пропущенные за
+                # время входа моменты расписания не догоняются
+                await self.relogin(measured)
+                next_at = max(next_at + interval, time.time())
+                continue
+            start = time.perf_counter_ns()
+            try:
+                future = self.client.request(self.next_request())
+            except OSError:
+                self.counters['errors'] += 1
+                break
+            if measured:
+                self.counters['sent'] += 1
+            self.outstanding.add(future)
+            future.add_done_callback(lambda done, start=start, measured=measured:
+                                     self.answered(start, measured, done))
+            next_at += interval
+        # Ответы на последние запросы
+        if self.outstanding:
+            await asyncio.wait(list(self.outstanding), timeout=REQUEST_TIMEOUT)
+
+
+async def run_clients(config, numbers, hashes, ready, start):
+    latency = Histogram()
+    rtt = Histogram()
+    counters = {'sent': 0, 'delivered': 0, 'errors': 0}
+    # До начала замера (например, сообщения прошлых запусков) не учитываем
+    config['measure_from'] = float('inf')
+    clients = [LoadClient(config, number, hashes[user_name(number)], latency, rtt, counters)
+               for number in numbers]
+    # Подключения открываются порциями, чтобы не переполнить очередь
+    # приёма сервера и уложиться в срок авторизации
+    logins = asyncio.Semaphore(50)
+
+    async def login(load_client):
+        async with logins:
+            await load_client.client.login()
+
+    await asyncio.gather(*(login(load_client) for load_client in clients))
+    ready.put(len(clients))
+    # Общее для всех процессов время начала трафика
+    start_at = await asyncio.get_running_loop().run_in_executor(None, start.get)
+    config['measure_from'] = start_at + config['warmup']
+    await asyncio.gather(*(load_client.run(start_at, start_at + config['warmup'] + config['duration'])
+                           for load_client in clients))
+    # Соединения закрываются, когда трафик закончили все процессы:
+    # иначе последние сообщения другим процессам ушли бы в офлайн
+    ready.put(len(clients))
+    await asyncio.get_running_loop().run_in_executor(None, start.get)
+    await asyncio.gather(*(load_client.client.close() for load_client in clients))
+    return latency.counts, latency.total, rtt.counts, rtt.total, counters
+
+
+def client_process(config, numbers, hashes, ready, start, results):
+    """Точка входа процесса с клиентами."""
+    logging.disable(logging.CRITICAL)
+    try:
+        results.put(asyncio.run(run_clients(config, numbers, hashes, ready, start)))
+    except (OSError, ServerError) as err:
+        ready.put(0)
+        results.put(repr(err))
+
+
+def summary(histogram):
+    """Перцентили гистограммы в миллисекундах."""
+    return {f'p{percent}': round(histogram.percentile(percent) / 1e6, 3)
+            for percent in (50, 99, 99.9)}
+
+
+def main():
+    parser = arg_parser()
+    args = parser.parse_args()
+    if args.connect and not args.database:
+        parser.error('для --connect нужен --database - файл базы запущенного сервера')
+    if args.pattern == 'pairwise' and args.users % 2:
+        args.users += 1
+    workdir = tempfile.TemporaryDirectory()
+    database_file = args.database or os.path.join(workdir.name, 'loadgen.db3')
+    address, port = DEFAULT_IP_ADDRESS, args.port
+    if args.connect:
+        address, port = args.connect.rsplit(':', 1)
+        port = int(port)
+
+    started = time.time()
+    hashes = register(database_file, args.users, args.pattern, args.room_size)
+    print(f'Зарегистрировано пользователей: {args.users} за {time.time() - started:.1f} с')
+
+    context = multiprocessing.get_context('spawn')
+    server = None
+    server_pid = args.server_pid
+    if not args.connect:
+        server = context.Process(target=serve, args=(args.engine, args.workers, address, port, database_file))
+        server.start()
+        server_pid = server.pid
+        wait_port(address, port)
+        # Воркерам кластера нужно время, чтобы подключиться к брокеру
+        time.sleep(1 if args.workers > 1 else 0.2)
+
+    config = dict(vars(args), address=address, port=port)
+    ready, results = context.Queue(), context.Queue()
+    processes = []
+    for index in range(args.processes):
+        numbers = range(index, args.users, args.processes)
+        start = context.Queue()
+        processes.append((context.Process(
+            target=client_process,
+            args=(config, numbers, {user_name(number): hashes[user_name(number)] for number in numbers},
+                  ready, start, results)), start))
+    started = time.time()
+    for process, start in processes:
+        process.start()
+    connected = sum(ready.get() for _ in processes)
+    print(f'Подключено клиентов: {connected} за {time.time() - started:.1f} с')
+    if connected != args.users:
+        for process, start in processes:
+            process.terminate()
+        if server is not None:
+            server.terminate()
+        sys.exit('Не все клиенты подключились.')
+
+    start_at = time.time() + 0.5
+    for process, start in processes:
+        start.put(start_at)
+    # Замер сервера: CPU за время замера без разогрева, наибольший RSS
+    time.sleep(max(0, start_at + args.warmup - time.time()))
+    cpu_start, rss_max = server_usage(server_pid) if server_pid else (0, 0)
+    measure_end = start_at + args.warmup + args.duration
+    while time.time() < measure_end:
+        time.sleep(min(0.5, max(0, measure_end - time.time())))
+        if server_pid:
+            rss_max = max(rss_max, server_usage(server_pid)[1])
+    cpu_end = server_usage(server_pid)[0] if server_pid else 0
+    for process, start in processes:
+        ready.get()
+    for process, start in processes:
+        start.put(None)
+
+    latency, rtt = Histogram(), Histogram()
+    totals = {'sent': 0, 'delivered': 0, 'errors': 0}
+    for _ in processes:
+        result = results.get()
+        if isinstance(result, str):
+            sys.exit(f'Ошибка процесса клиентов: {result}')
+        latency_counts, latency_total, rtt_counts, rtt_total, counters = result
+        latency.merge(latency_counts, latency_total)
+        rtt.merge(rtt_counts, rtt_total)
+        for key, value in counters.items():
+            totals[key] += value
+    for process, start in processes:
+        process.join()
+    if server is not None:
+        server.terminate()
+        server.join()
+
+    report = {
+        'sent': totals['sent'],
+        'delivered': totals['delivered'],
+        'errors': totals['errors'],
+        'sent_per_second': round(totals['sent'] / args.duration, 1),
+        'delivered_per_second': round(totals['delivered'] / args.duration, 1),
+        'delivery_ms': summary(latency),
+        'request_ms': summary(rtt),
+        'server_cpu_percent': round((cpu_end - cpu_start) / args.duration * 100, 1) if server_pid else None,
+        'server_rss_mb': round(rss_max / 2 ** 20, 1) if server_pid else None,
+    }
+    parameters = {key: value for key, value in vars(args).items() if key not in ('json', 'database')}
+    print('Параметры:', json.dumps(parameters, ensure_ascii=False))
+    print(f'Отправлено {report["sent"]} ({report["sent_per_second"]}/с), '
+          f'доставлено {report["delivered"]} ({report["delivered_per_second"]}/с), ошибок {report["errors"]}')
+    if args.pattern not in ('churn', 'logins'):
+        print('Доставка, мс:', ', '.join(f'{key} {value}' for key, value in report['delivery_ms'].items()))
+    print('Вход, мс:' if args.pattern == 'logins' else 'Запрос - ответ, мс:', ', '.join(f'{key} {value}' for key, value in report['request_ms'].items()))
+    if server_pid:
+        print(f'Сервер: CPU {report["server_cpu_percent"]}%, RSS до {report["server_rss_mb"]} МБ')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'parameters': parameters, 'results': report}, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Накладные расходы журналирования на одно сообщение.
+
+Первая таблица - обёртка @log (decors.log) вокруг функции, получающей
+словарь сообщения, при уровне INFO: прежняя обёртка, собиравшая f-строку
+на каждый вызов (воспроизведена ниже), ленивая обёртка и вызов без
+обёртки (python -O или MESSENGER_LOG_CALLS=0).
+Вторая - запись logger.info в файл прямо из вызывающего потока и
+через очередь (log.background) с записью в отдельном потоке.
+
+Запуск из корня проекта: python benchmarks/logging_bench.py
+"""
+import base64
+import logging
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.variables import *
+from decors import log, logger as decors_logger
+from log.background import write_in_background, stop_listener
+
+MESSAGE = {ACTION: MESSAGE, SENDER: 'user_one', DESTINATION: 'user_two', TIME: time.time(),
+           MESSAGE_TEXT: base64.b64encode(os.urandom(256)).decode('ascii')}
+
+
+def eager_log(func_to_log):
+    """Прежняя обёртка: f-строка с аргументами собирается при любом уровне."""
+    def log_saver(*args, **kwargs):
+        decors_logger.debug(f'Была вызвана функция {func_to_log.__name__} c параметрами {args} , {kwargs}. Вызов из модуля {func_to_log.__module__}')
+        ret = func_to_log(*args, **kwargs)
+        return ret
+    return log_saver
+
+
+def send(sock, message):
+    return message
+
+
+def file_logger(name, path, queued):
+    target = logging.getLogger(name)
+    target.propagate = False
+    target.setLevel(logging.INFO)
+    handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)-8s - %(module)s - %(message)s'))
+    listener = None
+    if queued:
+        listener = write_in_background(target, handler)
+    else:
+        target.addHandler(handler)
+    return target, listener
+
+
+def main(number=100000):
+    decors_logger.setLevel(logging.INFO)
+    print('Обёртка @log, нс на вызов')
+    for title, func in (('f-строка', eager_log(send)), ('ленивая', log(send)), ('без обёртки', send)):
+        elapsed = timeit.timeit(lambda: func(None, MESSAGE), number=number)
+        print(f'{title:<14}{elapsed / number * 1e9:>10.0f}')
+
+    print()
+    print('logger.info на сообщение, мкс в вызывающем потоке')
+    with tempfile.TemporaryDirectory() as workdir:
+        for title, queued in (('файл', False), ('очередь', True)):
+            target, listener = file_logger(f'bench.{title}', os.path.join(workdir, f'{queued}.log'), queued)
+            elapsed = timeit.timeit(
+                lambda: target.info('Отправлено сообщение пользователю %s от пользователя %s.',
+                                    MESSAGE[DESTINATION], MESSAGE[SENDER]),
+                number=number // 10)
+            if listener is not None:
+                stop_listener(listener)
+            for handler in target.handlers:
+                handler.close()
+            print(f'{title:<14}{elapsed / (number // 10) * 1e6:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
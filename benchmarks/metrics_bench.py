@@ -0,0 +1,62 @@
+"""
+Стоимость одного наблюдения метрик (common.metrics).
+
+Берётся лучшее из пяти повторений, из него вычитается время пустого
+вызова, то есть в таблице - только затраты на саму метрику: увеличение
+счётчика, запись в гистограмму, замер времени вокруг обработчика (как
+в process_client_message) и обёртка timed (как у методов ServerDB).
+Последняя строка - снимок в формате Prometheus для 20 гистограмм.
+
+Запуск из корня проекта: python benchmarks/metrics_bench.py
+"""
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.metrics import MetricsRegistry
+
+
+def noop():
+    pass
+
+
+def best(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5))
+
+
+def main(number=200000):
+    registry = MetricsRegistry()
+    counter = registry.counter('bench_total', 'Счётчик.')
+    histogram = registry.histogram('bench_seconds', 'Гистограмма.')
+    timed_noop = registry.timed('bench_timed_seconds', 'Обёртка timed.')(noop)
+    values = [random.randrange(1000, 10 ** 7) for _ in range(1024)]
+    perf_counter_ns = time.perf_counter_ns
+
+    def record():
+        histogram.record(values[0])
+
+    def measure():
+        start = perf_counter_ns()
+        noop()
+        histogram.record(perf_counter_ns() - start)
+
+    baseline = best(noop, number)
+    print('Наблюдение, нс сверх пустого вызова')
+    for title, func in (('Counter.inc', counter.inc), ('Histogram.record', record),
+                        ('замер обработчика', measure), ('обёртка timed', timed_noop)):
+        elapsed = best(func, number)
+        print(f'{title:<20}{(elapsed - baseline) / number * 1e9:>8.0f}')
+
+    for index in range(20):
+        target = registry.histogram('bench_actions_seconds', 'Гистограммы.', action=f'action_{index}')
+        for value in values:
+            target.record(value)
+    elapsed = best(registry.render, 100)
+    print(f'{"снимок, мкс":<20}{elapsed / 100 * 1e6:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
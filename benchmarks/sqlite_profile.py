@@ -0,0 +1,158 @@
+"""
+Влияние настроек SQLite (SQLITE_PRAGMAS) и индексов схемы на базу
+сервера со 100 тыс. пользователей: вход и выход, запись статистики
+сообщений пачками, история входов, контакт-лист и удаление пользователя.
+Каждый вариант работает в отдельном процессе с копией одной базы.
+
+Запуск из корня проекта: python benchmarks/sqlite_profile.py
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.variables import *
+
+INDEXES = ('ix_login_history_name', 'ix_contacts_user', 'ix_contacts_contact', 'ix_history_user')
+
+
+def create_schema(path):
+    '''Создание пустой базы без настроек SQLite (отдельный процесс: ServerDB один на процесс).'''
+    from server.server_db import ServerDB
+    ServerDB(path, pragmas='')
+
+
+def fill(path, users, contacts, logins):
+    '''Наполнение базы напрямую через sqlite3: пользователи, контакты, история входов.'''
+    now = datetime.datetime.now().isoformat(' ')
+    random.seed(1)
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO Users (id, name, last_login, passwd_hash) VALUES (?, ?, ?, ?)',
+        ((number, f'user_{number}', now, 'x' * 64) for number in range(1, users + 1)))
+    connection.executemany(
+        'INSERT INTO History (user, sent, accepted) VALUES (?, 0, 0)',
+        ((number,) for number in range(1, users + 1)))
+    connection.executemany(
+        'INSERT INTO Contacts (user, contact) VALUES (?, ?)',
+        ((number, random.randint(1, users))
+         for number in range(1, users + 1) for _ in range(contacts)))
+    connection.executemany(
+        'INSERT INTO Login_history (name, date_time, ip, port) VALUES (?, ?, ?, ?)',
+        ((number, now, '127.0.0.1', '7777')
+         for number in range(1, users + 1) for _ in range(logins)))
+    connection.commit()
+    connection.close()
+
+
+def strip_indexes(path):
+    '''Удаление индексов и версии схемы: база как до обновления.'''
+    connection = sqlite3.connect(path)
+    for index in INDEXES:
+        connection.execute(f'DROP INDEX IF EXISTS {index}')
+    connection.execute('PRAGMA user_version = 0')
+    connection.commit()
+    connection.close()
+
+
+def rate(count, func):
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def measure(path, pragmas, indexes, users, operations, results):
+    '''Замеры в процессе одного варианта, результат кладётся в очередь.'''
+    from server import server_db
+    if not indexes:
+        # Схема остаётся в исходной версии
+        server_db.MIGRATIONS = ()
+    database = server_db.ServerDB(path, clear_active=False, pragmas=pragmas)
+    random.seed(2)
+    names = [f'user_{random.randint(1, users)}' for _ in range(operations)]
+
+    def logins():
+        for name in names:
+            database.user_login(name, '127.0.0.1', 7777, 'key')
+            database.user_logout(name)
+
+    def stats():
+        for start in range(0, len(names), 100):
+            database.write_stats({name: [1, 1] for name in names[start:start + 100]})
+
+    def history():
+        for name in names[:200]:
+            database.login_history(name)
+
+    def contacts():
+        for name in names[:200]:
+            database.reload_contacts(name)
+
+    def removes():
+        for name in set(names[:50]):
+            database.remove_user(name)
+
+    results.put({
+        'входов/с': rate(len(names), logins),
+        'статистика, зап./с': rate(len(names), stats),
+        'история, зап./с': rate(200, history),
+        'контакты, зап./с': rate(200, contacts),
+        'удалений/с': rate(len(set(names[:50])), removes),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', default=100000, type=int)
+    parser.add_argument('--contacts', default=10, type=int, help='контактов у пользователя')
+    parser.add_argument('--logins', default=5, type=int, help='записей истории входов на пользователя')
+    parser.add_argument('--operations', default=2000, type=int)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    workdir = tempfile.mkdtemp(prefix='sqlite_profile_')
+    template = os.path.join(workdir, 'template.db3')
+    process = context.Process(target=create_schema, args=(template,))
+    process.start()
+    process.join()
+    start = time.perf_counter()
+    fill(template, args.users, args.contacts, args.logins)
+    print(f'база: {args.users} пользователей, {args.users * args.contacts} контактов, '
+          f'{args.users * args.logins} входов, {time.perf_counter() - start:.1f} с\n')
+
+    variants = [('по умолчанию', '', False), ('по умолчанию', '', True),
+                ('SQLITE_PRAGMAS', SQLITE_PRAGMAS, False), ('SQLITE_PRAGMAS', SQLITE_PRAGMAS, True)]
+    header = None
+    try:
+        for title, pragmas, indexes in variants:
+            path = os.path.join(workdir, 'server.db3')
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            shutil.copyfile(template, path)
+            if not indexes:
+                strip_indexes(path)
+            results = context.Queue()
+            process = context.Process(target=measure, args=(
+                path, pragmas, indexes, args.users, args.operations, results))
+            process.start()
+            row = results.get()
+            process.join()
+            if header is None:
+                header = list(row)
+                print(f'{"настройки":<16}{"индексы":<9}' + ''.join(f'{name:>20}' for name in header))
+            print(f'{title:<16}{"да" if indexes else "нет":<9}'
+                  + ''.join(f'{row[name]:>20.0f}' for name in header))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
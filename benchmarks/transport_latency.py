@@ -0,0 +1,101 @@
+"""
+Задержка доставки входящих сообщений клиенту (client.transport).
+
+Запускает локальный сервер, подключает к нему получателя -
+ClientTransport - и отправителя на простом сокете. Отправитель шлёт
+сообщения по одному и ждёт ответа сервера, время доставки считается от
+отправки до сигнала new_message у получателя. Для сравнения выводится
+время полного оборота запрос - ответ того же отправителя.
+
+Запуск из корня проекта: python benchmarks/transport_latency.py
+"""
+import binascii
+import hashlib
+import hmac
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from socket import create_connection
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Cryptodome.PublicKey import RSA
+from PyQt5.QtCore import Qt
+
+from client.client_database import ClientDatabase
+from client.transport import ClientTransport
+from common.utils import get_message, send_message
+from common.variables import *
+from server.core import MessageProcessor
+from server.server_db import ServerDB
+
+PORT = 17900
+PASSWORD = '123'
+
+
+def password_hash(name):
+    return binascii.hexlify(
+        hashlib.pbkdf2_hmac('sha512', PASSWORD.encode(ENCODING), name.lower().encode(ENCODING), 10000))
+
+
+def login(name):
+    """Авторизация отправителя на простом сокете."""
+    sock = create_connection((DEFAULT_IP_ADDRESS, PORT))
+    sock.settimeout(5)
+    send_message(sock, {ACTION: PRESENCE, TIME: time.time(),
+                        USER: {ACCOUNT_NAME: name, PUBLIC_KEY: 'key'}})
+    ans = get_message(sock)
+    digest = hmac.new(password_hash(name), ans[DATA].encode(ENCODING), 'MD5').digest()
+    send_message(sock, {RESPONSE: 511, DATA: binascii.b2a_base64(digest).decode('ascii')})
+    get_message(sock)
+    return sock
+
+
+def main(number=500):
+    workdir = tempfile.TemporaryDirectory()
+    # База клиента создаётся в текущем каталоге
+    os.chdir(workdir.name)
+    database = ServerDB(os.path.join(workdir.name, 'server.db3'))
+    for name in ('sender', 'receiver'):
+        database.add_user(name, password_hash(name))
+    server = MessageProcessor(DEFAULT_IP_ADDRESS, PORT, database)
+    server.daemon = True
+    server.start()
+    time.sleep(0.5)
+
+    received = threading.Event()
+    delivered = []
+    transport = ClientTransport(PORT, DEFAULT_IP_ADDRESS, ClientDatabase('receiver'),
+                                'receiver', PASSWORD, RSA.generate(1024))
+    transport.new_message.connect(
+        lambda sender: (delivered.append(time.perf_counter()), received.set()), Qt.DirectConnection)
+    transport.daemon = True
+    transport.start()
+    sender = login('sender')
+
+    latencies = []
+    round_trips = []
+    for number in range(number):
+        received.clear()
+        start = time.perf_counter()
+        send_message(sender, {ACTION: MESSAGE, SENDER: 'sender', DESTINATION: 'receiver',
+                              TIME: time.time(), MESSAGE_TEXT: f'text {number}'})
+        get_message(sender)
+        round_trips.append(time.perf_counter() - start)
+        if not received.wait(5):
+            print('Сообщение не доставлено.')
+            break
+        latencies.append(delivered[-1] - start)
+
+    transport.transport_shutdown()
+    transport.join()
+    for title, values in (('доставка', latencies), ('запрос - ответ', round_trips)):
+        values = sorted(values)
+        print(f'{title:<16}медиана {statistics.median(values) * 1000:.3f} мс, '
+              f'95% {values[int(len(values) * 0.95)] * 1000:.3f} мс')
+
+
+if __name__ == '__main__':
+    main()
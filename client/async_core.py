@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+from socket import timeout
+
+from client.core import ClientSession
+from common.utils import accept_binary, decoder_for, encode_for
+from common.variables import *
+from errors import ServerError
+
+logger = logging.getLogger('messenger.client')
+
+
+class AsyncClient(ClientSession):
+    '''
+    Клиент на asyncio: методы API - корутины, приём ведёт задача в цикле
+    событий. Клиент не создаёт потоков, поэтому в одном процессе можно
+    держать тысячи клиентов (нагрузочные тесты, боты).
+    '''
+
+    def __init__(self, ip_address, port, username, password, public_key='', version=0, **options):
+        super().__init__(username, password, public_key, version, **options)
+        self.address = (ip_address, port)
+        self.reader = None
+        self.writer = None
+        # Декодер входящего потока и параметры отправки, ключ - сам клиент
+        self.decoder = decoder_for(self)
+        self.receiver = None
+        self.running = False
+
+    def new_future(self):
+        return asyncio.get_running_loop().create_future()
+
+    def post(self, message):
+        '''Метод отправки сообщения: байты уходят в буфер транспорта без ожидания.'''
+        if self.writer is None or self.writer.is_closing():
+            raise ConnectionResetError('Соединение с сервером закрыто.')
+        self.writer.write(encode_for(self, message))
+
+    async def get_message(self):
+        '''Метод приёма одного сообщения (до запуска приёмника).'''
+        while not self.decoder.pending:
+            data = await asyncio.wait_for(self.reader.read(MAX_PACKAGE_LENGTH), REQUEST_TIMEOUT)
+            if not data:
+                raise ConnectionResetError('Соединение закрыто удалённой стороной.')
+            self.decoder.pending.extend(self.decoder.feed(data))
+        return self.decoder.pending.popleft()
+
+    async def login(self):
+        '''Метод подключения к серверу, авторизации и запуска приёмника.'''
+        for i in range(5):
+            logger.info(f'Попытка подключения №{i + 1}')
+            try:
+                self.reader, self.writer = await asyncio.open_connection(*self.address)
+            except OSError:
+                await asyncio.sleep(1)
+            else:
+                break
+        else:
+            logger.critical('Не удалось установить соединение с сервером')
+            raise ServerError('Не удалось установить соединение с сервером')
+        logger.debug('Starting auth dialog.')
+        try:
+            # Ответ 200 и первые двоичные кадры могут прийти одним чтением
+            accept_binary(self)
+            self.post(self.presence())
+            my_ans = self.auth_answer(await self.get_message())
+            if my_ans is not None:
+                self.post(my_ans)
+                ans = await self.get_message()
+                while RESPONSE not in ans or ans[RESPONSE] == 205:
+                    self.route(ans)
+                    ans = await self.get_message()
+                self.auth_done(self, ans)
+        except (OSError, ValueError, asyncio.TimeoutError) as err:
+            logger.debug(f'Connection error.', exc_info=err)
+            self.writer.close()
+            raise ServerError('Сбой соединения в процессе авторизации.')
+        self.running = True
+        self.receiver = asyncio.get_running_loop().create_task(self.receive_loop())
+
+    async def receive_loop(self):
+        '''Задача приёма: разбирает сообщения по мере поступления.'''
+        # Сообщения, прочитанные вместе с ответами при авторизации
+        pending = self.decoder.pending
+        while pending:
+            self.route(pending.popleft())
+        try:
+            while self.running:
+                data = await self.reader.read(MAX_PACKAGE_LENGTH)
+                if not data:
+                    raise ConnectionResetError('Соединение закрыто удалённой стороной.')
+                for message in self.decoder.feed(data):
+                    logger.debug('Принято сообщение с сервера: %s', message)
+                    self.route(message)
+        except (OSError, ValueError) as err:
+            if self.running:
+                logger.critical(f'Потеряно соединение с сервером.', exc_info=err)
+                self.running = False
+                self.notify(self.on_connection_lost)
+        finally:
+            self.fail_pending()
+
+    def schedule_sync(self, version):
+        scheduled = self.sync_due is not None
+        super().schedule_sync(version)
+        if not scheduled and self.sync_due is not None:
+            asyncio.get_running_loop().call_later(
+                max(0, self.sync_due - time.monotonic()), self.sync_now)
+
+    def sync_now(self):
+        '''Метод отправки отложенного запроса синхронизации.'''
+        self.sync_due = None
+        if not self.running:
+            return
+        try:
+            self.sync_request().add_done_callback(self.sync_done)
+        except OSError as err:
+            logger.error(f'Не удалось синхронизировать список пользователей: {err}')
+
+    async def call(self, message):
+        '''Метод отправки запроса и ожидания ответа на него.'''
+        future = self.request(message)
+        try:
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.forget(message[REQUEST_ID])
+            raise timeout('Сервер не ответил на запрос.')
+
+    async def send_message(self, to, message):
+        self.process_server_ans(await self.call(self.message_request(to, message)))
+
+    async def send_room_message(self, room, message):
+        self.process_server_ans(await self.call(self.room_message_request(room, message)))
+
+    async def create_room(self, room):
+        self.process_server_ans(await self.call(self.room_request(ROOM_CREATE, room)))
+
+    async def join_room(self, room):
+        self.process_server_ans(await self.call(self.room_request(ROOM_JOIN, room)))
+
+    async def leave_room(self, room):
+        self.process_server_ans(await self.call(self.room_request(ROOM_LEAVE, room)))
+
+    async def rooms_list(self):
+        return self.list_answer(await self.call(self.rooms_request()), 'Не удалось получить список комнат.')
+
+    async def contacts_list(self):
+        return self.list_answer(
+            await self.call(self.contacts_request()), 'Не удалось обновить список контактов.')
+
+    async def users_list(self):
+        return self.list_answer(
+            await self.call(self.users_request()), 'Не удалось обновить список известных пользователей.')
+
+    async def key_request(self, user):
+        return self.key_answer(await self.call(self.key_request_message(user)), user)
+
+    async def add_contact(self, contact):
+        self.process_server_ans(await self.call(self.contact_request(ADD_CONTACT, contact)))
+
+    async def remove_contact(self, contact):
+        self.process_server_ans(await self.call(self.contact_request(REMOVE_CONTACT, contact)))
+
+    async def users_sync(self):
+        '''Метод синхронизации списка пользователей, возвращает изменения или None.'''
+        return self.apply_sync(await self.call(self.sync_message()))
+
+    async def close(self):
+        '''Метод завершения работы: сообщает серверу о выходе и закрывает соединение.'''
+        self.running = False
+        if self.writer is None:
+            return
+        try:
+            self.post(self.exit_message())
+            await self.writer.drain()
+        except OSError:
+            pass
+        self.writer.close()
+        if self.receiver is not None:
+            self.receiver.cancel()
+            try:
+                await self.receiver
+            except asyncio.CancelledError:
+                pass
+        logger.debug('Клиент завершает работу.')
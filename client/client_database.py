@@ -27,6 +27,12 @@ class ClientDatabase:
             self.id = None
             self.name = contact
 
+    # Класс - отображение версии списка известных пользователей
+    class SyncState:
+        def __init__(self, version):
+            self.id = None
+            self.version = version
+
     # Конструктор класса:
     def __init__(self, name):
         # Создаём движок базы данных, поскольку разрешено несколько клиентов одновременно,
@@ -41,10 +47,11 @@ class ClientDatabase:
         # Создаём объект MetaData
         self.metadata = MetaData()
 
-        # Создаём таблицу известных пользователей
+        # Создаём таблицу известных пользователей. Индекс по имени нужен
+        # изменениям списка с сервера: они ищут и удаляют отдельные имена
         users = Table('known_users', self.metadata,
                       Column('id', Integer, primary_key=True),
-                      Column('username', String)
+                      Column('username', String, index=True)
                       )
 
         # Создаём таблицу истории сообщений
@@ -62,13 +69,23 @@ class ClientDatabase:
                          Column('name', String, unique=True)
                          )
 
-        # Создаём таблицы
+        # Создаём таблицу с версией списка пользователей, полученной с сервера
+        sync_state = Table('sync_state', self.metadata,
+                           Column('id', Integer, primary_key=True),
+                           Column('version', Integer)
+                           )
+
+        # Создаём таблицы. Индексы уже существующих таблиц create_all не
+        # создаёт, в базах прежних версий их добавляем отдельно
         self.metadata.create_all(self.database_engine)
+        for index in users.indexes:
+            index.create(self.database_engine, checkfirst=True)
 
         # Создаём отображения
         mapper(self.KnownUsers, users)
         mapper(self.MessageHistory, history)
         mapper(self.Contacts, contacts)
+        mapper(self.SyncState, sync_state)
 
         # Создаём сессию
         Session = sessionmaker(bind=self.database_engine)
@@ -99,6 +116,36 @@ class ClientDatabase:
             self.session.add(user_row)
         self.session.commit()
 
+    # Функция возвращает версию списка известных пользователей
+    def get_version(self):
+        state = self.session.query(self.SyncState).first()
+        return state.version if state else 0
+
+    # Функция применяет изменения списка пользователей, полученные с сервера.
+    # Удалённые пользователи удаляются и из контактов. Из таблицы читаются
+    # только добавленные имена, а не весь список пользователей.
+    def apply_users_delta(self, added, removed, version, full=False):
+        if full:
+            self.session.query(self.KnownUsers).delete()
+            known = set()
+        elif added:
+            known = {user[0] for user in self.session.query(self.KnownUsers.username).filter(
+                self.KnownUsers.username.in_(added))}
+        else:
+            known = set()
+        self.session.add_all([self.KnownUsers(user) for user in added if user not in known])
+        if removed:
+            self.session.query(self.KnownUsers).filter(
+                self.KnownUsers.username.in_(removed)).delete(synchronize_session=False)
+            self.session.query(self.Contacts).filter(
+                self.Contacts.name.in_(removed)).delete(synchronize_session=False)
+        state = self.session.query(self.SyncState).first()
+        if state:
+            state.version = version
+        else:
+            self.session.add(self.SyncState(version))
+        self.session.commit()
+
     # Функция сохраняет сообщения
     def save_message(self, from_user, to_user, message):
         message_row = self.MessageHistory(from_user, to_user, message)
@@ -0,0 +1,587 @@
+"""
+Клиентская библиотека без графического интерфейса.
+
+ClientSession - протокол клиента без ввода-вывода: сообщения запросов,
+разбор ответов и входящих сообщений, ответ на запрос авторизации.
+Client - клиент на потоках: приёмник ждёт готовности сокета, отправку
+ведёт отдельный поток, методы API ждут ответа на свой запрос.
+Клиент на asyncio - client.async_core.AsyncClient.
+
+Вместо сигналов Qt клиент вызывает функции, переданные в конструктор:
+on_message(message) - принято сообщение пользователя или комнаты,
+on_users_changed(delta) - изменился список пользователей (ответ на
+запрос sync), on_connection_lost() - соединение потеряно.
+Функции вызываются в потоке (или цикле событий) приёмника.
+"""
+import binascii
+import hashlib
+import hmac
+import itertools
+import logging
+import queue
+import random
+import selectors
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from socket import socket, socketpair, timeout, AF_INET, SOCK_STREAM, SHUT_RDWR
+
+sys.path.append('../')
+from common.utils import get_message, send_message, read_messages, set_binary, accept_binary, \
+    enable_compression, decoder_for
+from common.variables import *
+from errors import ServerError
+
+logger = logging.getLogger('messenger.client')
+
+
+def password_hash(username, password):
+    '''
+    Хэш пароля, который хранит сервер: PBKDF2 с именем пользователя
+    в качестве соли, в hex представлении.
+    '''
+    passwd_hash = hashlib.pbkdf2_hmac(
+        'sha512', password.encode('utf-8'), username.lower().encode('utf-8'), 10000)
+    return binascii.hexlify(passwd_hash)
+
+
+class ClientSession:
+    '''
+    Протокол клиента без ввода-вывода. Подклассы отправляют сообщения
+    (post) и создают Future для ответов на запросы (new_future).
+    '''
+
+    def __init__(self, username, password, public_key='', version=0, passwd_hash=None,
+                 on_message=None, on_users_changed=None, on_connection_lost=None):
+        self.username = username
+        # Пароль не хранится, для ответа на запрос 511 нужен только хэш.
+        # Уже вычисленный хэш можно передать в passwd_hash.
+        self.passwd_hash = passwd_hash or password_hash(username, password)
+        self.public_key = public_key
+        # Версия списка известных пользователей и время отложенной
+        # синхронизации после уведомления 205
+        self.version = version
+        self.sync_due = None
+        # Запросы, ожидающие ответа: номер запроса -> Future
+        self.request_ids = itertools.count(1)
+        self.pending = dict()
+        self.pending_lock = threading.Lock()
+        # Обработчики событий
+        self.on_message = on_message
+        self.on_users_changed = on_users_changed
+        self.on_connection_lost = on_connection_lost
+
+    def post(self, message):
+        '''Метод отправки сообщения серверу.'''
+        raise NotImplementedError
+
+    def new_future(self):
+        return Future()
+
+    def notify(self, callback, *args):
+        '''Метод вызова обработчика события. Ошибка обработчика не прерывает приём.'''
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as err:
+            logger.error(f'Ошибка в обработчике {callback}.', exc_info=err)
+
+    def presence(self):
+        '''Метод формирования приветственного сообщения.'''
+        return {
+            ACTION: PRESENCE,
+            TIME: time.time(),
+            USER: {
+                ACCOUNT_NAME: self.username,
+                PUBLIC_KEY: self.public_key
+            },
+            CAPABILITIES: list(CAPABILITIES_SUPPORTED)
+        }
+
+    def auth_answer(self, ans):
+        '''
+        Метод разбора ответа на presence. Возвращает ответ на запрос 511
+        или None, если сервер ничего не запрашивал.
+        '''
+        logger.debug(f'Server response = {ans}.')
+        if RESPONSE not in ans:
+            return None
+        if ans[RESPONSE] == 400:
+            raise ServerError(ans[ERROR])
+        if ans[RESPONSE] != 511:
+            return None
+        digest = hmac.new(self.passwd_hash, ans[DATA].encode('utf-8'), 'MD5').digest()
+        return {RESPONSE: 511, DATA: binascii.b2a_base64(digest).decode('ascii')}
+
+    def auth_done(self, sock, ans):
+        '''
+        Метод завершения авторизации по ответу сервера: включает
+        подтверждённые сервером возможности соединения sock.
+        '''
+        if CAP_BINARY in ans.get(CAPABILITIES, ()):
+            set_binary(sock)
+        if CAP_ZLIB in ans.get(CAPABILITIES, ()):
+            enable_compression(sock)
+        self.process_server_ans(ans)
+
+    def request(self, message):
+        '''
+        Метод отправки запроса без ожидания ответа. Запросу назначается
+        номер, ответ с этим номером придёт в возвращаемый Future, поэтому
+        можно отправить много запросов подряд и разбирать ответы по мере
+        поступления.
+        '''
+        future = self.new_future()
+        with self.pending_lock:
+            request_id = next(self.request_ids)
+            self.pending[request_id] = future
+        message[REQUEST_ID] = request_id
+        try:
+            self.post(message)
+        except OSError:
+            self.forget(request_id)
+            raise
+        return future
+
+    def forget(self, request_id):
+        '''Метод отказа от ожидания ответа на запрос.'''
+        with self.pending_lock:
+            self.pending.pop(request_id, None)
+
+    def route(self, message):
+        '''
+        Метод разбора принятого сообщения. Ответ с номером запроса
+        передаётся ожидающему его Future, остальное - в process_server_ans.
+        '''
+        if RESPONSE in message and REQUEST_ID in message:
+            with self.pending_lock:
+                future = self.pending.pop(message[REQUEST_ID], None)
+            if future is None or future.done():
+                logger.debug(f'Ответ на неизвестный запрос {message[REQUEST_ID]}')
+            else:
+                future.set_result(message)
+            return
+        try:
+            self.process_server_ans(message)
+        except ServerError as err:
+            logger.error(f'Ошибка от сервера вне запроса: {err}')
+
+    def fail_pending(self):
+        '''Метод завершения ожидающих запросов при потере соединения.'''
+        with self.pending_lock:
+            pending = list(self.pending.values())
+            self.pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(ServerError('Потеряно соединение с сервером!'))
+
+    def process_server_ans(self, message):
+        logger.debug('Разбор сообщения от сервера: %s', message)
+
+        # Если это подтверждение чего-либо
+        if RESPONSE in message:
+            if message[RESPONSE] == 200:
+                return
+            elif message[RESPONSE] == 400:
+                raise ServerError(f'{message[ERROR]}')
+            elif message[RESPONSE] == 205:
+                self.schedule_sync(message.get(VERSION))
+            else:
+                logger.debug(f'Принят неизвестный код подтверждения {message[RESPONSE]}')
+
+        # Если это сообщения, накопленные на сервере, пока мы были не в сети,
+        # разбираем их как обычные и подтверждаем получение всей пачки
+        elif ACTION in message \
+                and message[ACTION] == OFFLINE \
+                and LIST_INFO in message \
+                and MESSAGE_ID in message:
+            for offline_message in message[LIST_INFO]:
+                self.process_server_ans(offline_message)
+            ack = {
+                ACTION: ACK,
+                TIME: time.time(),
+                USER: self.username,
+                MESSAGE_ID: message[MESSAGE_ID]
+            }
+            self.post(ack)
+
+        # Сообщение от пользователя
+        elif ACTION in message \
+                and message[ACTION] == MESSAGE \
+                and SENDER in message \
+                and DESTINATION in message \
+                and MESSAGE_TEXT in message \
+                and message[DESTINATION] == self.username:
+            logger.debug('Получено сообщение от пользователя %s:%s',
+                         message[SENDER], message[MESSAGE_TEXT])
+            self.notify(self.on_message, message)
+
+        # Сообщение в комнату
+        elif ACTION in message \
+                and message[ACTION] == ROOM_MESSAGE \
+                and SENDER in message \
+                and ROOM in message \
+                and MESSAGE_TEXT in message:
+            logger.debug('Получено сообщение в комнату %s от %s', message[ROOM], message[SENDER])
+            self.notify(self.on_message, message)
+
+    def schedule_sync(self, version):
+        '''
+        Метод планирования синхронизации списка пользователей после
+        уведомления 205. Несколько уведомлений подряд дают один запрос,
+        а случайная задержка разносит запросы клиентов во времени.
+        '''
+        if version is not None and version <= self.version:
+            return
+        if self.sync_due is None:
+            self.sync_due = time.monotonic() + random.uniform(0, SYNC_JITTER)
+
+    def sync_message(self):
+        '''Запрос изменений списка пользователей с известной версии.'''
+        logger.debug(f'Синхронизация списка пользователей с версии {self.version}')
+        return {
+            ACTION: SYNC,
+            TIME: time.time(),
+            USER: self.username,
+            VERSION: self.version
+        }
+
+    def sync_request(self):
+        '''Метод отправки запроса синхронизации без ожидания ответа.'''
+        return self.request(self.sync_message())
+
+    def apply_sync(self, ans):
+        '''
+        Метод применения ответа на запрос синхронизации. Возвращает
+        изменения (словарь с ключами VERSION, ADDED, REMOVED, FULL) или
+        None, если синхронизация не удалась.
+        '''
+        if RESPONSE in ans and ans[RESPONSE] == 202 and VERSION in ans:
+            self.version = ans[VERSION]
+            return {key: ans[key] for key in (VERSION, ADDED, REMOVED, FULL)}
+        logger.error('Не удалось синхронизировать список пользователей.')
+        return None
+
+    def sync_done(self, future):
+        '''Обработчик ответа на синхронизацию, запрошенную приёмником.'''
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error(f'Не удалось синхронизировать список пользователей: {future.exception()}')
+            return
+        delta = self.apply_sync(future.result())
+        if delta is not None:
+            self.notify(self.on_users_changed, delta)
+
+    # Запросы API. Ответы разбирают list_answer и key_answer
+    # или process_server_ans (ошибка сервера - ServerError).
+    def message_request(self, to, message):
+        return {
+            ACTION: MESSAGE,
+            SENDER: self.username,
+            DESTINATION: to,
+            TIME: time.time(),
+            MESSAGE_TEXT: message
+        }
+
+    def room_message_request(self, room, message):
+        return {
+            ACTION: ROOM_MESSAGE,
+            SENDER: self.username,
+            ROOM: room,
+            TIME: time.time(),
+            MESSAGE_TEXT: message
+        }
+
+    def room_request(self, action, room):
+        '''Запрос создания комнаты, входа в неё или выхода.'''
+        logger.debug(f'Запрос {action} для комнаты {room}')
+        return {
+            ACTION: action,
+            TIME: time.time(),
+            USER: self.username,
+            ROOM: room
+        }
+
+    def rooms_request(self):
+        return {
+            ACTION: ROOMS_REQUEST,
+            TIME: time.time(),
+            USER: self.username
+        }
+
+    def contacts_request(self):
+        logger.debug(f'Запрос контакт листа для пользователя {self.username}')
+        return {
+            ACTION: GET_CONTACTS,
+            TIME: time.time(),
+            USER: self.username
+        }
+
+    def users_request(self):
+        logger.debug(f'Запрос списка известных пользователей {self.username}')
+        return {
+            ACTION: USERS_REQUEST,
+            TIME: time.time(),
+            ACCOUNT_NAME: self.username
+        }
+
+    def key_request_message(self, user):
+        logger.debug(f'Запрос публичного ключа для {user}')
+        return {
+            ACTION: PUBLIC_KEY_REQUEST,
+            TIME: time.time(),
+            ACCOUNT_NAME: user
+        }
+
+    def contact_request(self, action, contact):
+        '''Запрос добавления или удаления контакта.'''
+        logger.debug(f'Запрос {action} для контакта {contact}')
+        return {
+            ACTION: action,
+            TIME: time.time(),
+            USER: self.username,
+            ACCOUNT_NAME: contact
+        }
+
+    def exit_message(self):
+        return {
+            ACTION: EXIT,
+            TIME: time.time(),
+            ACCOUNT_NAME: self.username
+        }
+
+    def list_answer(self, ans, error):
+        '''Список из ответа 202 или None (с записью error в журнал).'''
+        if RESPONSE in ans and ans[RESPONSE] == 202:
+            return ans[LIST_INFO]
+        logger.error(error)
+        return None
+
+    def key_answer(self, ans, user):
+        '''Публичный ключ из ответа на запрос ключа или None.'''
+        if RESPONSE in ans and ans[RESPONSE] == 511:
+            return ans[DATA]
+        logger.error(f'Не удалось получить ключ собеседника {user}.')
+        return None
+
+
+class Client(ClientSession, threading.Thread):
+    '''
+    Клиент на потоках. login() подключается и авторизуется, start()
+    запускает приёмник, после чего методы API можно вызывать из любых
+    потоков: каждый ждёт ответа на свой запрос.
+    '''
+
+    def __init__(self, ip_address, port, username, password, public_key='', version=0, **options):
+        ClientSession.__init__(self, username, password, public_key, version, **options)
+        threading.Thread.__init__(self)
+        self.address = (ip_address, port)
+        self.transport = None
+        # Блокировка записи в сокет. Чтение ведёт только поток приёмника,
+        # а после его запуска пишет только поток отправки, поэтому
+        # блокировка нужна лишь на время запуска.
+        self.socket_lock = threading.RLock()
+        # Очередь исходящих сообщений и её поток отправки
+        self.outgoing = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        # Пара сокетов, чтобы разбудить приёмник при завершении работы
+        self.wakeup_in, self.wakeup_out = socketpair()
+        self.running = False
+
+    def login(self):
+        '''Метод подключения к серверу и авторизации.'''
+        self.transport = socket(AF_INET, SOCK_STREAM)
+        self.transport.settimeout(5)
+        connected = False
+        for i in range(5):
+            logger.info(f'Попытка подключения №{i + 1}')
+            try:
+                self.transport.connect(self.address)
+            except (OSError, ConnectionRefusedError):
+                pass
+            else:
+                connected = True
+                break
+            time.sleep(1)
+        if not connected:
+            logger.critical('Не удалось установить соединение с сервером')
+            raise ServerError('Не удалось установить соединение с сервером')
+        logger.debug('Starting auth dialog.')
+
+        with self.socket_lock:
+            try:
+                # Ответ 200 и первые двоичные кадры могут прийти одним чтением
+                accept_binary(self.transport)
+                send_message(self.transport, self.presence())
+                my_ans = self.auth_answer(get_message(self.transport))
+                if my_ans is not None:
+                    send_message(self.transport, my_ans)
+                    ans = get_message(self.transport)
+                    while RESPONSE not in ans or ans[RESPONSE] == 205:
+                        self.route(ans)
+                        ans = get_message(self.transport)
+                    self.auth_done(self.transport, ans)
+            except (OSError, ValueError) as err:
+                logger.debug(f'Connection error.', exc_info=err)
+                raise ServerError('Сбой соединения в процессе авторизации.')
+        self.running = True
+
+    def post(self, message):
+        '''
+        Метод отправки сообщения. После запуска приёмника сообщение
+        ставится в очередь потока отправки, до запуска - отправляется сразу.
+        '''
+        if self.writer.is_alive():
+            self.outgoing.put(message)
+        else:
+            with self.socket_lock:
+                send_message(self.transport, message)
+
+    def write_loop(self):
+        '''Поток отправки: пишет в сокет сообщения из очереди по порядку.'''
+        while True:
+            message = self.outgoing.get()
+            if message is None:
+                break
+            try:
+                with self.socket_lock:
+                    send_message(self.transport, message)
+            except OSError as err:
+                logger.error(f'Ошибка отправки сообщения на сервер.', exc_info=err)
+                # О потере соединения приёмник узнает из закрытого сокета
+                try:
+                    self.transport.shutdown(SHUT_RDWR)
+                except OSError:
+                    pass
+                break
+
+    def wait(self, future):
+        '''
+        Метод ожидания ответа на запрос. Пока приёмник не запущен (или
+        ждёт сам приёмник), сообщения читаются здесь же.
+        '''
+        if self.is_alive() and threading.current_thread() is not self:
+            try:
+                return future.result(REQUEST_TIMEOUT)
+            except FutureTimeoutError:
+                raise timeout('Сервер не ответил на запрос.')
+        deadline = time.monotonic() + REQUEST_TIMEOUT
+        while not future.done():
+            if time.monotonic() > deadline:
+                raise timeout('Сервер не ответил на запрос.')
+            try:
+                message = get_message(self.transport)
+            except timeout:
+                continue
+            self.route(message)
+        return future.result()
+
+    def call(self, message):
+        '''Метод отправки запроса и ожидания ответа на него.'''
+        return self.wait(self.request(message))
+
+    def send_message(self, to, message):
+        self.process_server_ans(self.call(self.message_request(to, message)))
+        logger.info('Отправлено сообщение для пользователя %s', to)
+
+    def send_room_message(self, room, message):
+        self.process_server_ans(self.call(self.room_message_request(room, message)))
+        logger.info('Отправлено сообщение в комнату %s', room)
+
+    def create_room(self, room):
+        self.process_server_ans(self.call(self.room_request(ROOM_CREATE, room)))
+
+    def join_room(self, room):
+        self.process_server_ans(self.call(self.room_request(ROOM_JOIN, room)))
+
+    def leave_room(self, room):
+        self.process_server_ans(self.call(self.room_request(ROOM_LEAVE, room)))
+
+    def rooms_list(self):
+        return self.list_answer(self.call(self.rooms_request()), 'Не удалось получить список комнат.')
+
+    def contacts_list(self):
+        return self.list_answer(self.call(self.contacts_request()), 'Не удалось обновить список контактов.')
+
+    def users_list(self):
+        return self.list_answer(
+            self.call(self.users_request()), 'Не удалось обновить список известных пользователей.')
+
+    def key_request(self, user):
+        '''Метод запрашивающий с сервера публичный ключ пользователя.'''
+        return self.key_answer(self.call(self.key_request_message(user)), user)
+
+    def add_contact(self, contact):
+        self.process_server_ans(self.call(self.contact_request(ADD_CONTACT, contact)))
+
+    def remove_contact(self, contact):
+        self.process_server_ans(self.call(self.contact_request(REMOVE_CONTACT, contact)))
+
+    def users_sync(self):
+        '''Метод синхронизации списка пользователей, возвращает изменения или None.'''
+        return self.apply_sync(self.wait(self.sync_request()))
+
+    def shutdown(self):
+        '''Метод завершения работы: сообщает серверу о выходе и останавливает приёмник.'''
+        self.running = False
+        try:
+            self.post(self.exit_message())
+        except OSError:
+            pass
+        # Поток отправки завершится, отправив всё, что было в очереди
+        self.outgoing.put(None)
+        self.wakeup_out.send(b'\0')
+        if self.writer.is_alive():
+            self.writer.join(REQUEST_TIMEOUT)
+        logger.debug('Клиент завершает работу.')
+
+    def run(self):
+        logger.debug('Запущен процесс - приёмник сообщений с сервера.')
+        self.writer.start()
+        # Приёмник единственный читает из сокета и ждёт готовности сокета
+        # без блокировок и опроса по таймеру: сообщение разбирается сразу,
+        # как только пришло. Таймаут ожидания - только до синхронизации.
+        selector = selectors.DefaultSelector()
+        selector.register(self.transport, selectors.EVENT_READ)
+        selector.register(self.wakeup_in, selectors.EVENT_READ)
+        # Сообщения, прочитанные вместе с ответами до запуска приёмника
+        pending = decoder_for(self.transport).pending
+        while pending:
+            self.route(pending.popleft())
+        while self.running:
+            delay = None
+            if self.sync_due is not None:
+                delay = max(0, self.sync_due - time.monotonic())
+            for key, events in selector.select(delay):
+                if key.fileobj is self.wakeup_in:
+                    self.wakeup_in.recv(MAX_PACKAGE_LENGTH)
+                else:
+                    self.receive()
+            if self.running and self.sync_due is not None and time.monotonic() >= self.sync_due:
+                self.sync_due = None
+                try:
+                    self.sync_request().add_done_callback(self.sync_done)
+                except OSError as err:
+                    logger.error(f'Не удалось синхронизировать список пользователей: {err}')
+        selector.close()
+        # Дальнейшие отправки пойдут мимо очереди и сообщат об ошибке сразу
+        self.outgoing.put(None)
+        self.fail_pending()
+
+    def receive(self):
+        '''Метод чтения из готового сокета и разбора всех принятых сообщений.'''
+        try:
+            messages = read_messages(self.transport)
+        except (OSError, ValueError) as err:
+            # Проблемы с соединением или некорректные данные
+            if self.running:
+                logger.critical(f'Потеряно соединение с сервером.', exc_info=err)
+                self.running = False
+                self.notify(self.on_connection_lost)
+            return
+        for message in messages:
+            logger.debug('Принято сообщение с сервера: %s', message)
+            self.route(message)
@@ -1,40 +1,42 @@
 import json
 import logging
 import sys
-import threading
-import time
-from socket import socket, AF_INET, SOCK_STREAM
 from PyQt5.QtCore import pyqtSignal, QObject
 
 sys.path.append('../')
-from common.utils import get_message, send_message
+from client.core import Client
 from common.variables import *
-from decors import log
 from errors import ServerError
 from log import client_log_config
 
 
 logger = logging.getLogger('messenger.client')
-socket_lock = threading.Lock()
 
 
-class ClientTransport(threading.Thread, QObject):
+class ClientTransport(Client, QObject):
+    '''
+    Транспорт графического клиента: клиент client.core.Client, который
+    сохраняет принятое в базу клиента и сообщает о событиях сигналами Qt.
+    '''
     new_message = pyqtSignal(str)
     connection_lost = pyqtSignal()
     message_205 = pyqtSignal()
 
     def __init__(self, port, ip_address, database, username, passwd, keys):
-        threading.Thread.__init__(self)
+        # Получаем публичный ключ и декодируем его из байтов
+        Client.__init__(self, ip_address, port, username, passwd,
+                        public_key=keys.publickey().export_key().decode('ascii'),
+                        version=database.get_version())
         QObject.__init__(self)
 
         self.database = database
-        self.username = username
-        self.password = passwd
-        self.transport = None
         self.keys = keys
-        self.connection_init(port, ip_address)
+        self.on_message = self.save_message
+        self.on_users_changed = self.users_changed
+        self.on_connection_lost = self.connection_lost.emit
+        self.login()
         try:
-            self.user_list_update()
+            self.users_sync()
             self.contacts_list_update()
         except OSError as err:
             if err.errno:
@@ -44,229 +46,42 @@ class ClientTransport(threading.Thread, QObject):
         except json.JSONDecodeError:
             logger.critical(f'Потеряно соединение с сервером.')
             raise ServerError('Потеряно соединение с сервером!')
-        self.running = True
-
-    def connection_init(self, port, ip):
-        self.transport = socket(AF_INET, SOCK_STREAM)
-        self.transport.settimeout(5)
-        connected = False
-        for i in range(5):
-            logger.info(f'Попытка подключения №{i + 1}')
-            try:
-                self.transport.connect((ip, port))
-            except (OSError, ConnectionRefusedError):
-                pass
-            else:
-                connected = True
-                break
-            time.sleep(1)
-        if not connected:
-            logger.critical('Не удалось установить соединение с сервером')
-            raise ServerError('Не удалось установить соединение с сервером')
-        logger.debug('Starting auth dialog.')
-
-        passwd_bytes = self.password.encode('utf-8')
-        salt = self.username.lower().encode('utf-8')
-        passwd_hash = hashlib.pbkdf2_hmac('sha512', passwd_bytes, salt, 10000)
-        passwd_hash_string = binascii.hexlify(passwd_hash)
-
-        logger.debug(f'Passwd hash ready: {passwd_hash_string}')
-
-        # Получаем публичный ключ и декодируем его из байтов
-        pubkey = self.keys.publickey().export_key().decode('ascii')
 
-        # Авторизируемся на сервере
-        with socket_lock:
-            presense = {
-                ACTION: PRESENCE,
-                TIME: time.time(),
-                USER: {
-                    ACCOUNT_NAME: self.username,
-                    PUBLIC_KEY: pubkey
-                }
-            }
-            logger.debug(f"Presense message = {presense}")
-            # Отправляем серверу приветственное сообщение.
-            try:
-                send_message(self.transport, presense)
-                ans = get_message(self.transport)
-                logger.debug(f'Server response = {ans}.')
-                # Если сервер вернул ошибку, бросаем исключение.
-                if RESPONSE in ans:
-                    if ans[RESPONSE] == 400:
-                        raise ServerError(ans[ERROR])
-                    elif ans[RESPONSE] == 511:
-                        # Если всё нормально, то продолжаем процедуру
-                        # авторизации.
-                        ans_data = ans[DATA]
-                        hash = hmac.new(passwd_hash_string, ans_data.encode('utf-8'), 'MD5')
-                        digest = hash.digest()
-                        my_ans = RESPONSE_511
-                        my_ans[DATA] = binascii.b2a_base64(
-                            digest).decode('ascii')
-                        send_message(self.transport, my_ans)
-                        self.process_server_ans(get_message(self.transport))
-            except (OSError, json.JSONDecodeError) as err:
-                logger.debug(f'Connection error.', exc_info=err)
-                raise ServerError('Сбой соединения в процессе авторизации.')
+    def save_message(self, message):
+        '''Сохраняет принятое сообщение в истории и даёт сигнал о новом сообщении.'''
+        if message[ACTION] == ROOM_MESSAGE:
+            self.database.save_message(
+                message[ROOM], 'in', f'{message[SENDER]}: {message[MESSAGE_TEXT]}')
+            self.new_message.emit(message[ROOM])
+        else:
+            self.database.save_message(message[SENDER], 'in', message[MESSAGE_TEXT])
+            self.new_message.emit(message[SENDER])
 
-    def process_server_ans(self, message):
-        logger.debug(f'Разбор сообщения от сервера: {message}')
+    def store_users_delta(self, delta):
+        self.database.apply_users_delta(delta[ADDED], delta[REMOVED], delta[VERSION], delta[FULL])
 
-        # Если это подтверждение чего-либо
-        if RESPONSE in message:
-            if message[RESPONSE] == 200:
-                return
-            elif message[RESPONSE] == 400:
-                raise ServerError(f'{message[ERROR]}')
-            elif message[RESPONSE] == 205:
-                self.user_list_update()
-                self.contacts_list_update()
-                self.message_205.emit()
-            else:
-                logger.debug(f'Принят неизвестный код подтверждения {message[RESPONSE]}')
+    def users_changed(self, delta):
+        '''Обработчик синхронизации, запрошенной приёмником после уведомления 205.'''
+        self.store_users_delta(delta)
+        self.message_205.emit()
 
-        # Если это сообщение от пользователя добавляем в базу, даём сигнал о новом сообщении
-        elif ACTION in message \
-                and message[ACTION] == MESSAGE \
-                and SENDER in message \
-                and DESTINATION in message \
-                and MESSAGE_TEXT in message \
-                and message[DESTINATION] == self.username:
-            logger.debug(f'Получено сообщение от пользователя {message[SENDER]}:'
-                         f'{message[MESSAGE_TEXT]}')
-            self.database.save_message(message[SENDER], 'in', message[MESSAGE_TEXT])
-            self.new_message.emit(message[SENDER])
+    def users_sync(self):
+        delta = Client.users_sync(self)
+        if delta is not None:
+            self.store_users_delta(delta)
+        return delta
 
     def contacts_list_update(self):
-        logger.debug(f'Запрос контакт листа для пользователя {self.name}')
-        req = {
-            ACTION: GET_CONTACTS,
-            TIME: time.time(),
-            USER: self.username
-        }
-        logger.debug(f'Сформирован запрос {req}')
-        with socket_lock:
-            send_message(self.transport, req)
-            ans = get_message(self.transport)
-        logger.debug(f'Получен ответ {ans}')
-        if RESPONSE in ans and ans[RESPONSE] == 202:
-            for contact in ans[LIST_INFO]:
+        contacts = self.contacts_list()
+        if contacts is not None:
+            for contact in contacts:
                 self.database.add_contact(contact)
-        else:
-            logger.error('Не удалось обновить список контактов.')
 
     def user_list_update(self):
-        logger.debug(f'Запрос списка известных пользователей {self.username}')
-        req = {
-            ACTION: USERS_REQUEST,
-            TIME: time.time(),
-            ACCOUNT_NAME: self.username
-        }
-        with socket_lock:
-            send_message(self.transport, req)
-            ans = get_message(self.transport)
-        if RESPONSE in ans and ans[RESPONSE] == 202:
-            self.database.add_users(ans[LIST_INFO])
-        else:
-            logger.error('Не удалось обновить список известных пользователей.')
-
-    def key_request(self, user):
-        '''Метод запрашивающий с сервера публичный ключ пользователя.'''
-        logger.debug(f'Запрос публичного ключа для {user}')
-        req = {
-            ACTION: PUBLIC_KEY_REQUEST,
-            TIME: time.time(),
-            ACCOUNT_NAME: user
-        }
-        with socket_lock:
-            send_message(self.transport, req)
-            ans = get_message(self.transport)
-        if RESPONSE in ans and ans[RESPONSE] == 511:
-            return ans[DATA]
-        else:
-            logger.error(f'Не удалось получить ключ собеседника{user}.')
-
-    def add_contact(self, contact):
-        logger.debug(f'Создание контакта {contact}')
-        req = {
-            ACTION: ADD_CONTACT,
-            TIME: time.time(),
-            USER: self.username,
-            ACCOUNT_NAME: contact
-        }
-        with socket_lock:
-            send_message(self.transport, req)
-            self.process_server_ans(get_message(self.transport))
-
-    def remove_contact(self, contact):
-        logger.debug(f'Удаление контакта {contact}')
-        req = {
-            ACTION: REMOVE_CONTACT,
-            TIME: time.time(),
-            USER: self.username,
-            ACCOUNT_NAME: contact
-        }
-        with socket_lock:
-            send_message(self.transport, req)
-            self.process_server_ans(get_message(self.transport))
+        users = self.users_list()
+        if users is not None:
+            self.database.add_users(users)
 
     def transport_shutdown(self):
-        self.running = False
-        message = {
-            ACTION: EXIT,
-            TIME: time.time(),
-            ACCOUNT_NAME: self.username
-        }
-        with socket_lock:
-            try:
-                send_message(self.transport, message)
-            except OSError:
-                pass
+        self.shutdown()
         logger.debug('Транспорт завершает работу.')
-        time.sleep(0.5)
-
-    def send_message(self, to, message):
-        message_dict = {
-            ACTION: MESSAGE,
-            SENDER: self.username,
-            DESTINATION: to,
-            TIME: time.time(),
-            MESSAGE_TEXT: message
-        }
-        logger.debug(f'Сформирован словарь сообщения: {message_dict}')
-
-        # Необходимо дождаться освобождения сокета для отправки сообщения
-        with socket_lock:
-            send_message(self.transport, message_dict)
-            self.process_server_ans(get_message(self.transport))
-            logger.info(f'Отправлено сообщение для пользователя {to}')
-
-    def run(self):
-        logger.debug('Запущен процесс - приёмник сообщений с сервера.')
-        while self.running:
-            # Отдыхаем секунду и снова пробуем захватить сокет. Если не сделать тут задержку,
-            # то отправка может достаточно долго ждать освобождения сокета.
-            time.sleep(1)
-            with socket_lock:
-                try:
-                    self.transport.settimeout(0.5)
-                    message = get_message(self.transport)
-                except OSError as err:
-                    if err.errno:
-                        # выход по таймауту вернёт номер ошибки err.errno равный None
-                        # поэтому, при выходе по таймауту мы сюда попросту не попадём
-                        logger.critical(f'Потеряно соединение с сервером.')
-                        self.running = False
-                        self.connection_lost.emit()
-                # Проблемы с соединением
-                except (ConnectionError, ConnectionAbortedError,
-                        ConnectionResetError, json.JSONDecodeError, TypeError):
-                    logger.debug(f'Потеряно соединение с сервером.')
-                    self.running = False
-                    self.connection_lost.emit()
-                finally:
-                    self.transport.settimeout(5)
-            if message:
-                logger.debug(f'Принято сообщение с сервера: {message}')
-                self.process_server_ans(message)
@@ -0,0 +1,276 @@
+"""
+Компактное двоичное представление сообщений JIM.
+
+Используется вместо JSON на соединениях, где клиент объявил
+возможность CAP_BINARY в сообщении presence и сервер подтвердил её
+в ответе 200. Тело кадра начинается с байта BINARY_MARKER, который
+не может быть первым байтом JSON, поэтому формат определяется по
+каждому кадру отдельно.
+
+Ключи протокола и частые строковые значения передаются одним байтом -
+номером в таблицах KEYS и VALUES. Таблицы можно только дополнять в
+конце, иначе старые клиенты прочитают сообщения неверно.
+Поля с текстом в base64 (шифротекст, дайджест авторизации) передаются
+сырыми байтами и при разборе снова превращаются в строку base64,
+так что словарь на принимающей стороне совпадает с отправленным.
+"""
+
+import binascii
+import struct
+
+from common.variables import *
+
+BINARY_MARKER = 0xB1
+
+# Ключи протокола, номер ключа - его индекс
+KEYS = (ACTION, TIME, USER, ACCOUNT_NAME, DESTINATION, SENDER, DATA,
+        PUBLIC_KEY, RESPONSE, ERROR, MESSAGE_TEXT, LIST_INFO, MESSAGE_ID,
+        ROOM, VERSION, ADDED, REMOVED, FULL, CAPABILITIES, REQUEST_ID)
+# Частые строковые значения
+VALUES = (PRESENCE, MESSAGE, EXIT, GET_CONTACTS, REMOVE_CONTACT, ADD_CONTACT,
+          USERS_REQUEST, PUBLIC_KEY_REQUEST, OFFLINE, ACK, ROOM_CREATE,
+          ROOM_JOIN, ROOM_LEAVE, ROOM_MESSAGE, ROOMS_REQUEST, SYNC, CAP_BINARY)
+# Поля, значения которых передаются сырыми байтами вместо base64
+BASE64_FIELDS = frozenset((MESSAGE_TEXT, DATA))
+
+KEY_IDS = {key: number for number, key in enumerate(KEYS)}
+VALUE_IDS = {value: number for number, value in enumerate(VALUES)}
+# Ключ не из таблицы: байт OTHER_KEY и строка с длиной
+OTHER_KEY = 0xFF
+# Допустимая вложенность списков и словарей. Разбор рекурсивный, без
+# предела кадр из вложенных списков исчерпал бы стек интерпретатора
+MAX_DEPTH = 32
+
+# Типы значений
+T_NONE = 0
+T_FALSE = 1
+T_TRUE = 2
+T_UINT8 = 3
+T_INT32 = 4
+T_INT64 = 5
+T_FLOAT = 6
+T_STR8 = 7
+T_STR32 = 8
+T_BYTES = 9
+T_BASE64 = 10
+T_VALUE = 11
+T_LIST = 12
+T_DICT = 13
+# Список строк без символа NUL: строки через NUL одним куском
+T_STRLIST = 14
+
+U16 = struct.Struct('!H')
+U32 = struct.Struct('!I')
+I32 = struct.Struct('!i')
+I64 = struct.Struct('!q')
+F64 = struct.Struct('!d')
+TAG_U16 = struct.Struct('!BH')
+TAG_U32 = struct.Struct('!BI')
+TAG_I32 = struct.Struct('!Bi')
+TAG_I64 = struct.Struct('!Bq')
+TAG_F64 = struct.Struct('!Bd')
+
+# Готовые байты заголовков, чтобы не упаковывать их на каждое сообщение
+MARKER = bytes((BINARY_MARKER,))
+KEY_HEADERS = {key: bytes((number,)) for key, number in KEY_IDS.items()}
+VALUE_HEADERS = {value: bytes((T_VALUE, number)) for value, number in VALUE_IDS.items()}
+STR8_HEADERS = [bytes((T_STR8, length)) for length in range(256)]
+UINT8_VALUES = [bytes((T_UINT8, value)) for value in range(256)]
+CONSTANTS = {None: bytes((T_NONE,)), True: bytes((T_TRUE,)), False: bytes((T_FALSE,))}
+
+
+def encode(message):
+    """
+    Кодирует словарь в двоичное тело кадра.
+    @param message: dict
+    @return: bytes
+    """
+    parts = [MARKER]
+    _encode_dict(message, parts)
+    return b''.join(parts)
+
+
+def _encode_dict(message, parts):
+    append = parts.append
+    append(TAG_U16.pack(T_DICT, len(message)))
+    for key, value in message.items():
+        header = KEY_HEADERS.get(key)
+        if header is None:
+            raw = key.encode(ENCODING)
+            append(bytes((OTHER_KEY,)))
+            append(U16.pack(len(raw)))
+            append(raw)
+        else:
+            append(header)
+        if value.__class__ is str:
+            if key in BASE64_FIELDS:
+                raw = _base64_to_raw(value)
+                if raw is not None:
+                    append(TAG_U32.pack(T_BASE64, len(raw)))
+                    append(raw)
+                    continue
+            header = VALUE_HEADERS.get(value)
+            if header is not None:
+                append(header)
+                continue
+            raw = value.encode(ENCODING)
+            if len(raw) < 256:
+                append(STR8_HEADERS[len(raw)])
+            else:
+                append(TAG_U32.pack(T_STR32, len(raw)))
+            append(raw)
+        else:
+            _encode_value(value, parts)
+
+
+def _encode_value(value, parts):
+    append = parts.append
+    kind = value.__class__
+    if kind is str:
+        header = VALUE_HEADERS.get(value)
+        if header is not None:
+            append(header)
+            return
+        raw = value.encode(ENCODING)
+        if len(raw) < 256:
+            append(STR8_HEADERS[len(raw)])
+        else:
+            append(TAG_U32.pack(T_STR32, len(raw)))
+        append(raw)
+    elif kind is int:
+        if 0 <= value < 256:
+            append(UINT8_VALUES[value])
+        elif -2 ** 31 <= value < 2 ** 31:
+            append(TAG_I32.pack(T_INT32, value))
+        else:
+            append(TAG_I64.pack(T_INT64, value))
+    elif kind is float:
+        append(TAG_F64.pack(T_FLOAT, value))
+    elif kind is dict:
+        _encode_dict(value, parts)
+    elif kind is list or kind is tuple:
+        if value and all(item.__class__ is str for item in value):
+            raw = '\0'.join(value).encode(ENCODING)
+            if b'\0' not in raw or raw.count(b'\0') == len(value) - 1:
+                append(TAG_U32.pack(T_STRLIST, len(raw)))
+                append(raw)
+                return
+        append(TAG_U32.pack(T_LIST, len(value)))
+        for item in value:
+            _encode_value(item, parts)
+    elif value is None or value is True or value is False:
+        append(CONSTANTS[value])
+    elif kind is bytes or kind is bytearray:
+        append(TAG_U32.pack(T_BYTES, len(value)))
+        append(value)
+    else:
+        raise TypeError(f'Тип {kind.__name__} не поддерживается.')
+
+
+def _base64_to_raw(value):
+    """Байты строки base64 или None, если строка не в каноническом base64."""
+    try:
+        raw = binascii.a2b_base64(value)
+    except (binascii.Error, ValueError):
+        return None
+    # Строка должна восстанавливаться побайтно
+    if binascii.b2a_base64(raw, newline=False) != value.encode('ascii'):
+        return None
+    return raw
+
+
+def decode(body):
+    """
+    Разбирает двоичное тело кадра прямо из буфера приёма: строки
+    декодируются из срезов memoryview, тело в отдельный объект bytes
+    не копируется.
+    @param body: memoryview тела кадра, начиная с BINARY_MARKER
+    @return: dict
+    """
+    try:
+        message, offset = _decode_value(body, 1, 0)
+    except (IndexError, struct.error, RecursionError) as err:
+        raise ValueError('Некорректное двоичное сообщение.') from err
+    if offset != len(body) or message.__class__ is not dict:
+        raise ValueError('Некорректное двоичное сообщение.')
+    return message
+
+
+def _decode_value(view, offset, depth):
+    tag = view[offset]
+    offset += 1
+    if (tag == T_DICT or tag == T_LIST) and depth >= MAX_DEPTH:
+        raise ValueError('Слишком глубокая вложенность двоичного сообщения.')
+    if tag == T_DICT:
+        count, = U16.unpack_from(view, offset)
+        offset += 2
+        result = {}
+        for _ in range(count):
+            number = view[offset]
+            if number == OTHER_KEY:
+                length, = U16.unpack_from(view, offset + 1)
+                offset += 3
+                key = str(view[offset:offset + length], ENCODING)
+                offset += length
+            else:
+                key = KEYS[number]
+                offset += 1
+            # Короткие строки и частые значения разбираются на месте
+            tag = view[offset]
+            if tag == T_STR8:
+                length = view[offset + 1]
+                offset += 2
+                result[key] = str(view[offset:offset + length], ENCODING)
+                offset += length
+            elif tag == T_VALUE:
+                result[key] = VALUES[view[offset + 1]]
+                offset += 2
+            else:
+                result[key], offset = _decode_value(view, offset, depth + 1)
+        return result, offset
+    if tag == T_VALUE:
+        return VALUES[view[offset]], offset + 1
+    if tag == T_STR8:
+        length = view[offset]
+        offset += 1
+        return str(view[offset:offset + length], ENCODING), offset + length
+    if tag == T_UINT8:
+        return view[offset], offset + 1
+    if tag == T_FLOAT:
+        return F64.unpack_from(view, offset)[0], offset + 8
+    if tag == T_BASE64:
+        length, = U32.unpack_from(view, offset)
+        offset += 4
+        text = binascii.b2a_base64(view[offset:offset + length], newline=False)
+        return text.decode('ascii'), offset + length
+    if tag == T_STR32:
+        length, = U32.unpack_from(view, offset)
+        offset += 4
+        return str(view[offset:offset + length], ENCODING), offset + length
+    if tag == T_STRLIST:
+        length, = U32.unpack_from(view, offset)
+        offset += 4
+        return str(view[offset:offset + length], ENCODING).split('\0'), offset + length
+    if tag == T_LIST:
+        count, = U32.unpack_from(view, offset)
+        offset += 4
+        result = []
+        for _ in range(count):
+            item, offset = _decode_value(view, offset, depth + 1)
+            result.append(item)
+        return result, offset
+    if tag == T_INT32:
+        return I32.unpack_from(view, offset)[0], offset + 4
+    if tag == T_INT64:
+        return I64.unpack_from(view, offset)[0], offset + 8
+    if tag == T_NONE:
+        return None, offset
+    if tag == T_TRUE:
+        return True, offset
+    if tag == T_FALSE:
+        return False, offset
+    if tag == T_BYTES:
+        length, = U32.unpack_from(view, offset)
+        offset += 4
+        return bytes(view[offset:offset + length]), offset + length
+    raise ValueError(f'Неизвестный тип значения {tag}.')
@@ -0,0 +1,329 @@
+"""
+Метрики сервера: счётчики, показатели и гистограммы задержек.
+
+Метрики создаются один раз (при импорте модуля или в конструкторе
+обработчика) и дальше обновляются без поиска по имени, поэтому одно
+наблюдение стоит несколько сотен наносекунд. Счётчики и гистограммы
+пишутся из нескольких потоков (цикл сервера, поток базы, GUI): каждый
+поток обновляет свою ячейку метрики, а снимок складывает ячейки, так
+что наблюдения не теряются и блокировка при записи не нужна. Снимок всех метрик
+отдаётся в текстовом формате Prometheus, в том числе по HTTP на
+локальном адресе (start_http_server).
+"""
+
+import functools
+import inspect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Гистограмма: 2**SUB_BITS корзин на каждую степень двойки, то есть
+# относительная погрешность не больше 1/2**SUB_BITS (как у HDR Histogram
+# с одной значащей десятичной цифрой)
+SUB_BITS = 3
+# Наибольшее различимое значение - 2**MAX_BITS наносекунд (около 18 минут),
+# большие значения попадают в последнюю корзину
+MAX_BITS = 40
+BUCKETS = ((MAX_BITS - SUB_BITS) << SUB_BITS) + (1 << (SUB_BITS + 1))
+
+
+def bucket_index(value):
+    """Номер корзины гистограммы для целого неотрицательного значения."""
+    shift = value.bit_length() - SUB_BITS - 1
+    if shift <= 0:
+        return value
+    return (shift << SUB_BITS) + (value >> shift)
+
+
+def bucket_upper(index):
+    """Верхняя граница (не включительно) корзины с номером index."""
+    if index < 1 << (SUB_BITS + 1):
+        return index + 1
+    shift = (index >> SUB_BITS) - 1
+    top = index - (shift << SUB_BITS)
+    return (top + 1) << shift
+
+
+class ThreadCells:
+    """
+    Ячейки метрики по потокам: поток получает свою ячейку при первой
+    записи (threading.local) и дальше пишет в неё без блокировки.
+    Список всех ячеек нужен для снимка.
+    """
+    __slots__ = ('local', 'cells', 'lock', 'factory')
+
+    def __init__(self, factory):
+        self.local = threading.local()
+        self.cells = []
+        self.lock = threading.Lock()
+        self.factory = factory
+
+    def new_cell(self):
+        cell = self.local.cell = self.factory()
+        with self.lock:
+            self.cells.append(cell)
+        return cell
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.cells)
+
+
+class Counter:
+    """Монотонный счётчик с ячейкой на каждый пишущий поток."""
+    __slots__ = ('threads',)
+    kind = 'counter'
+
+    def __init__(self):
+        # Ячейка: [значение]
+        self.threads = ThreadCells(lambda: [0])
+
+    def inc(self, amount=1):
+        try:
+            self.threads.local.cell[0] += amount
+        except AttributeError:
+            self.threads.new_cell()[0] += amount
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in self.threads.snapshot())
+
+
+class Gauge:
+    """
+    Текущее значение. Если задана функция, значение вычисляется ею в
+    момент снимка, и обновлять показатель не нужно.
+    """
+    __slots__ = ('value', 'function')
+    kind = 'gauge'
+
+    def __init__(self, function=None):
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value if self.function is None else self.function()
+
+
+class Histogram:
+    """
+    Гистограмма задержек в наносекундах с лог-линейными корзинами
+    (как в HDR Histogram): память и время записи не зависят от числа
+    наблюдений. Каждый пишущий поток ведёт свои корзины.
+    """
+    __slots__ = ('threads',)
+    kind = 'histogram'
+
+    def __init__(self):
+        # Ячейка: [корзины, сумма значений]
+        self.threads = ThreadCells(lambda: [[0] * BUCKETS, 0])
+
+    def _cell(self):
+        try:
+            return self.threads.local.cell
+        except AttributeError:
+            return self.threads.new_cell()
+
+    @property
+    def counts(self):
+        """Корзины, сложенные по всем потокам."""
+        counts = [0] * BUCKETS
+        for cell in self.threads.snapshot():
+            for index, bucket_count in enumerate(cell[0]):
+                counts[index] += bucket_count
+        return counts
+
+    @property
+    def total(self):
+        return sum(cell[1] for cell in self.threads.snapshot())
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def record(self, value):
+        """Записывает наблюдение value наносекунд."""
+        try:
+            cell = self.threads.local.cell
+        except AttributeError:
+            cell = self.threads.new_cell()
+        cell[1] += value
+        shift = value.bit_length() - SUB_BITS - 1
+        if shift > 0:
+            value = (shift << SUB_BITS) + (value >> shift)
+        # Слишком большие значения - в последнюю корзину
+        cell[0][value if value < BUCKETS else -1] += 1
+
+    def merge(self, counts, total):
+        """Добавляет корзины и сумму другой гистограммы (например, из другого процесса)."""
+        cell = self._cell()
+        for index, bucket_count in enumerate(counts):
+            cell[0][index] += bucket_count
+        cell[1] += total
+
+    def percentile(self, percent):
+        """Верхняя граница корзины, в которую попадает перцентиль, в наносекундах."""
+        counts = self.counts
+        count = sum(counts)
+        if not count:
+            return 0
+        rank = count * percent / 100
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                return bucket_upper(index)
+        return bucket_upper(BUCKETS - 1)
+
+
+class MetricsRegistry:
+    """
+    Набор метрик процесса. Метрика определяется именем и метками,
+    повторный запрос возвращает тот же объект.
+    """
+
+    def __init__(self):
+        # {имя: (тип, описание)}
+        self.families = dict()
+        # {(имя, метки): метрика}
+        self.metrics = dict()
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, description, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                self.families.setdefault(name, (cls.kind, description))
+                metric = self.metrics[key] = cls(*args)
+        return metric
+
+    def counter(self, name, description, **labels):
+        return self._get(Counter, name, description, labels)
+
+    def gauge(self, name, description, function=None, **labels):
+        gauge = self._get(Gauge, name, description, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, description, **labels):
+        return self._get(Histogram, name, description, labels)
+
+    def timed(self, name, description, **labels):
+        """Декоратор, записывающий время выполнения функции в гистограмму."""
+        record = self.histogram(name, description, **labels).record
+        perf_counter_ns = time.perf_counter_ns
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    record(perf_counter_ns() - start)
+            return wrapper
+        return decorator
+
+    def timed_methods(self, name, description, label='method'):
+        """
+        Декоратор класса: время каждого публичного метода записывается
+        в свою гистограмму с именем метода в метке label.
+        """
+        def decorator(cls):
+            for attr, func in list(vars(cls).items()):
+                if attr.startswith('_') or not inspect.isfunction(func):
+                    continue
+                setattr(cls, attr, self.timed(name, description, **{label: attr})(func))
+            return cls
+        return decorator
+
+    def render(self):
+        """Снимок всех метрик в текстовом формате Prometheus."""
+        with self.lock:
+            metrics = sorted(self.metrics.items(), key=lambda item: item[0])
+            families = dict(self.families)
+        lines = []
+        current = None
+        for (name, labels), metric in metrics:
+            if name != current:
+                kind, description = families[name]
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {kind}')
+                current = name
+            if metric.kind == 'histogram':
+                lines.extend(_render_histogram(name, labels, metric))
+            elif metric.kind == 'gauge':
+                lines.append(f'{name}{_labels(labels)} {metric.get()}')
+            else:
+                lines.append(f'{name}{_labels(labels)} {metric.value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _render_histogram(name, labels, histogram):
+    """Строки гистограммы: только непустые корзины, границы в секундах."""
+    counts = list(histogram.counts)
+    seen = 0
+    for index, count in enumerate(counts):
+        if count:
+            seen += count
+            upper = bucket_upper(index) / 1e9
+            yield f'{name}_bucket{_labels(labels, ("le", repr(upper)))} {seen}'
+    yield f'{name}_bucket{_labels(labels, ("le", "+Inf"))} {seen}'
+    yield f'{name}_sum{_labels(labels)} {histogram.total / 1e9!r}'
+    yield f'{name}_count{_labels(labels)} {seen}'
+
+
+# Метрики процесса
+metrics = MetricsRegistry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Отдаёт снимок метрик по GET /metrics."""
+    registry = metrics
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Опросы Prometheus не пишутся в журнал
+        pass
+
+
+def start_http_server(port, registry=metrics):
+    """
+    Запускает в фоновом потоке HTTP сервер метрик. Сервер слушает только
+    127.0.0.1: метрики не предназначены для внешней сети.
+    @return: ThreadingHTTPServer
+    """
+    handler = type('Handler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
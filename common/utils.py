@@ -1,38 +1,328 @@
+import errno
 import json
+import struct
+import weakref
+import zlib
+from collections import deque
 
-from common.variables import MAX_PACKAGE_LENGTH, ENCODING
+from common import codec
+from common.metrics import metrics
+from common.variables import MAX_PACKAGE_LENGTH, MAX_FRAME_LENGTH, ENCODING, \
+    COMPRESS_THRESHOLD, COMPRESS_LEVEL, COMPRESS_WBITS
 from decors import log
 
+# Заголовок кадра: длина тела сообщения, 4 байта в сетевом порядке.
+FRAME_HEADER = struct.Struct('!I')
+# Старший бит длины - тело кадра сжато потоковым deflate соединения.
+COMPRESSED_FLAG = 0x80000000
+# Сообщения старых клиентов без заголовка всегда начинаются с '{'.
+LEGACY_START = ord('{')
+
+# Декодеры входящего потока, по одному на каждый сокет.
+_decoders = weakref.WeakKeyDictionary()
+_json_decoder = json.JSONDecoder()
+
+# Счётчики принятых байт и кадров по формату тела: {двоичный: счётчик}
+BYTES_RECEIVED = metrics.counter('messenger_bytes_received_total', 'Байт принято из сокетов.')
+FRAMES_DECODED = {binary: metrics.counter('messenger_frames_decoded_total', 'Принято сообщений.',
+                                          format='binary' if binary else 'json')
+                  for binary in (False, True)}
+FRAMES_ENCODED = {binary: metrics.counter('messenger_frames_encoded_total', 'Закодировано сообщений.',
+                                          format='binary' if binary else 'json')
+                  for binary in (False, True)}
+
+
+class FrameDecoder:
+    """
+    Инкрементальный декодер входящего потока одного соединения.
+    Накапливает принятые байты в буфере и отдаёт все полностью
+    принятые сообщения, остаток ждёт следующего чтения.
+    Формат определяется по первому байту потока: кадры с заголовком
+    длины или (для старых клиентов) JSON без разделителей.
+    Здесь же хранятся согласованные для соединения параметры отправки:
+    двоичный формат и контекст сжатия, а также счётчики байт до и
+    после сжатия.
+    """
+    __slots__ = ('buffer', 'framed', 'binary', 'binary_in', 'compressor', 'compress_threshold',
+                 'decompressor', 'raw_in', 'wire_in', 'raw_out', 'wire_out', 'pending')
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # None - формат ещё не известен, True - кадры, False - старый формат
+        self.framed = None
+        # Отправлять ли на это соединение двоичные кадры (common.codec)
+        self.binary = False
+        # Принимать ли двоичные кадры. До согласования CAP_BINARY -
+        # только JSON: двоичный разбор не доступен до авторизации
+        self.binary_in = False
+        # Потоковые контексты deflate: словарь сохраняется между кадрами
+        self.compressor = None
+        self.compress_threshold = COMPRESS_THRESHOLD
+        self.decompressor = None
+        # Счётчики байт кадров с заголовками: без сжатия и фактически
+        # переданные по сети
+        self.raw_in = 0
+        self.wire_in = 0
+        self.raw_out = 0
+        self.wire_out = 0
+        # Сообщения, принятые, но ещё не выданные get_message
+        self.pending = deque()
+
+    def feed(self, data):
+        """
+        Добавляет принятые байты в буфер.
+        @param data: bytes принятые из сокета
+        @return: list of dict - ноль или более полностью принятых сообщений
+        """
+        BYTES_RECEIVED.inc(len(data))
+        self.buffer += data
+        if self.framed is None and self.buffer:
+            self.framed = self.buffer[0] != LEGACY_START
+        if self.framed:
+            return self._split_frames()
+        return self._split_legacy()
+
+    def _split_frames(self):
+        buffer = self.buffer
+        size = len(buffer)
+        offset = 0
+        messages = []
+        # Тела кадров разбираются через memoryview, без копирования. Все
+        # срезы должны быть освобождены до изменения размера буфера.
+        with memoryview(buffer) as view:
+            while size - offset >= FRAME_HEADER.size:
+                length, = FRAME_HEADER.unpack_from(buffer, offset)
+                compressed = length & COMPRESSED_FLAG
+                length &= ~COMPRESSED_FLAG
+                if length > MAX_FRAME_LENGTH:
+                    raise ValueError(f'Длина кадра {length} превышает допустимую.')
+                start = offset + FRAME_HEADER.size
+                end = start + length
+                if end > size:
+                    break
+                if compressed:
+                    with view[start:end] as body:
+                        messages.append(self._decode_body(memoryview(self._decompress(body))))
+                else:
+                    self.raw_in += FRAME_HEADER.size + length
+                    self.wire_in += FRAME_HEADER.size + length
+                    with view[start:end] as body:
+                        messages.append(self._decode_body(body))
+                offset = end
+        # Удаление с начала bytearray не перевыделяет память под буфер.
+        if offset:
+            del buffer[:offset]
+        return messages
+
+    def _decode_body(self, body):
+        if len(body) and body[0] == codec.BINARY_MARKER:
+            if not self.binary_in:
+                raise ValueError('Двоичный кадр до согласования CAP_BINARY.')
+            FRAMES_DECODED[True].inc()
+            return codec.decode(body)
+        FRAMES_DECODED[False].inc()
+        return _check_message(_loads(bytes(body)))
+
+    def _decompress(self, body):
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(-15)
+        data = self.decompressor.decompress(body, MAX_FRAME_LENGTH)
+        if self.decompressor.unconsumed_tail:
+            raise ValueError('Длина распакованного кадра превышает допустимую.')
+        self.raw_in += FRAME_HEADER.size + len(data)
+        self.wire_in += FRAME_HEADER.size + len(body)
+        return data
+
+    def _split_legacy(self):
+        try:
+            text = self.buffer.decode(ENCODING)
+        except UnicodeDecodeError:
+            # Многобайтовый символ разрезан между чтениями
+            if len(self.buffer) > MAX_PACKAGE_LENGTH:
+                raise
+            return []
+        messages = []
+        index = 0
+        while index < len(text):
+            try:
+                message, index = _json_decoder.raw_decode(text, index)
+            except RecursionError as err:
+                raise ValueError('Слишком глубокая вложенность сообщения.') from err
+            except json.JSONDecodeError:
+                # Сообщение принято не полностью
+                if len(self.buffer) > MAX_PACKAGE_LENGTH:
+                    raise
+                break
+            FRAMES_DECODED[False].inc()
+            messages.append(_check_message(message))
+            while index < len(text) and text[index].isspace():
+                index += 1
+        if index:
+            del self.buffer[:len(text[:index].encode(ENCODING))]
+        return messages
+
+
+def _loads(data):
+    try:
+        return json.loads(data)
+    except RecursionError as err:
+        raise ValueError('Слишком глубокая вложенность сообщения.') from err
+
+
+def _check_message(message):
+    if isinstance(message, dict):
+        return message
+    raise ValueError
+
+
+def decoder_for(sock):
+    """Возвращает декодер входящего потока сокета, создавая его при необходимости."""
+    decoder = _decoders.get(sock)
+    if decoder is None:
+        decoder = _decoders[sock] = FrameDecoder()
+    return decoder
+
+
+def encode_message(message, framed=True, binary=False):
+    """
+    Кодирует словарь в байты для отправки.
+    @param message: dict
+    @param framed: добавлять ли заголовок с длиной сообщения
+    @param binary: кодировать ли тело в двоичном формате common.codec
+    @return: bytes
+    """
+    FRAMES_ENCODED[binary].inc()
+    if binary:
+        encoded_message = codec.encode(message)
+    else:
+        encoded_message = json.dumps(message).encode(ENCODING)
+    if not framed:
+        return encoded_message
+    if len(encoded_message) > MAX_FRAME_LENGTH:
+        raise ValueError(f'Длина сообщения {len(encoded_message)} превышает допустимую.')
+    return FRAME_HEADER.pack(len(encoded_message)) + encoded_message
+
+
+def encode_for(sock, message):
+    """
+    Кодирует словарь в том формате, в котором общается сокет:
+    старым клиентам, приславшим JSON без заголовка, отвечаем так же.
+    @param sock: socket получателя
+    @param message: dict
+    @return: bytes
+    """
+    if not isinstance(message, dict):
+        raise TypeError
+    return compress_for(sock, encode_message(message, *wire_format(sock)))
+
+
+def wire_format(sock):
+    """
+    Формат, в котором сокет ждёт сообщения: пара (кадры с заголовком
+    длины - False для старых клиентов, двоичное тело).
+    """
+    decoder = _decoders.get(sock)
+    if decoder is None:
+        return True, False
+    return decoder.framed is not False, decoder.binary
+
+
+def set_binary(sock, binary=True):
+    """
+    Переключает соединение в двоичный формат common.codec: отправку
+    и приём.
+    """
+    decoder = decoder_for(sock)
+    decoder.binary = decoder.binary_in = binary
+
+
+def accept_binary(sock):
+    """
+    Разрешает приём двоичных кадров, не меняя формат отправки. Клиент,
+    предложивший CAP_BINARY, вызывает её до ответа 200: следующие за
+    ответом кадры сервера могут прийти в том же чтении.
+    """
+    decoder_for(sock).binary_in = True
+
+
+def enable_compression(sock, threshold=COMPRESS_THRESHOLD):
+    """
+    Включает сжатие кадров, отправляемых на сокет. Сжимаются только
+    кадры с телом не короче threshold байт.
+    """
+    decoder = decoder_for(sock)
+    # Окно 2**COMPRESS_WBITS и memLevel 5 - около 32 КБ памяти на соединение
+    decoder.compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -COMPRESS_WBITS, 5)
+    decoder.compress_threshold = threshold
+
+
+def compress_for(sock, frame):
+    """
+    Сжимает готовый кадр, если для сокета включено сжатие и тело
+    достаточно длинное. Кадр может быть общим для многих получателей,
+    поэтому он не изменяется: сжатый кадр - новый объект.
+    @param sock: socket получателя
+    @param frame: bytes кадр с заголовком длины
+    @return: bytes кадр для отправки
+    """
+    decoder = _decoders.get(sock)
+    if decoder is None or decoder.framed is False:
+        return frame
+    decoder.raw_out += len(frame)
+    compressor = decoder.compressor
+    if compressor is None or len(frame) - FRAME_HEADER.size < decoder.compress_threshold:
+        decoder.wire_out += len(frame)
+        return frame
+    with memoryview(frame) as view:
+        data = compressor.compress(view[FRAME_HEADER.size:]) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    decoder.wire_out += FRAME_HEADER.size + len(data)
+    return FRAME_HEADER.pack(len(data) | COMPRESSED_FLAG) + data
+
+
+def read_messages(sock):
+    """
+    Однократное чтение из готового сокета.
+    @param sock: socket, готовый к чтению
+    @return: list of dict - все полностью принятые сообщения
+    """
+    decoder = decoder_for(sock)
+    data = sock.recv(MAX_PACKAGE_LENGTH)
+    if not data:
+        raise ConnectionResetError(errno.ECONNRESET, 'Соединение закрыто удалённой стороной.')
+    messages = list(decoder.pending)
+    decoder.pending.clear()
+    messages.extend(decoder.feed(data))
+    return messages
+
 
 @log
 def get_message(client):
     """
     Утилита приёма и декодирования сообщения
     принимает байты выдаёт словарь, если принято
-    что-то другое отдаёт ошибку значения
+    что-то другое отдаёт ошибку значения.
+    Если за одно чтение пришло несколько сообщений,
+    остальные выдаются следующими вызовами.
     @param client: client socket
     @return: received message as dict
     """
-
-    encoded_response = client.recv(MAX_PACKAGE_LENGTH)
-    if isinstance(encoded_response, bytes):
-        json_response = encoded_response.decode(ENCODING)
-        response = json.loads(json_response)
-        if isinstance(response, dict):
-            return response
-        raise ValueError
-    raise ValueError
+    decoder = decoder_for(client)
+    while not decoder.pending:
+        encoded_response = client.recv(MAX_PACKAGE_LENGTH)
+        if not isinstance(encoded_response, bytes):
+            raise ValueError
+        if not encoded_response:
+            raise ConnectionResetError(errno.ECONNRESET, 'Соединение закрыто удалённой стороной.')
+        decoder.pending.extend(decoder.feed(encoded_response))
+    return decoder.pending.popleft()
 
 
 @log
 def send_message(sock, message):
     """
-    This function is used for sending json string
+    This function is used for sending json string.
+    Old clients that sent unframed json get unframed answers.
     @sock: client socket
     @message: dict  message for sending
     """
-    if not isinstance(message, dict):
-        raise TypeError
-    js_message = json.dumps(message)
-    encoded_message = js_message.encode(ENCODING)
-    sock.send(encoded_message)
+    sock.sendall(encode_for(sock, message))
@@ -1,8 +1,57 @@
 DEFAULT_PORT = 7777
 DEFAULT_IP_ADDRESS = '127.0.0.1'
 MAX_CONNECTIONS = 5
+# Очередь ожидающих подключений сервера
+LISTEN_BACKLOG = 1024
 
 MAX_PACKAGE_LENGTH = 10240
+# Максимальная длина одного кадра протокола
+MAX_FRAME_LENGTH = 16 * 1024 * 1024
+# Исходящие очереди клиентов на сервере: верхняя и нижняя границы в байтах
+OUT_HIGH_WATERMARK = 1024 * 1024
+OUT_LOW_WATERMARK = 256 * 1024
+# Что делать с переполненной очередью получателя: отбросить сообщение,
+# отключить получателя или приостановить чтение от отправителя.
+SLOW_CONSUMER_POLICIES = ('drop', 'disconnect', 'pause')
+SLOW_CONSUMER_POLICY = 'pause'
+# Время на авторизацию клиента после подключения, секунд
+AUTH_TIMEOUT = 5
+# Сколько сообщений клиента, ждущего ответа базы, сервер откладывает,
+# прежде чем перестать читать его сокет
+DB_BACKLOG_LIMIT = 64
+# Сообщения для отключённых пользователей: срок хранения в секундах,
+# максимум сообщений в очереди одного пользователя и размер пачки при выдаче
+OFFLINE_TTL = 7 * 24 * 60 * 60
+OFFLINE_QUOTA = 1000
+OFFLINE_BATCH = 100
+# Сжатие кадров: минимальная длина сжимаемого тела, уровень сжатия
+# и размер окна deflate (степень двойки)
+COMPRESS_THRESHOLD = 512
+COMPRESS_LEVEL = 6
+COMPRESS_WBITS = 12
+# Статистика сообщений пользователей копится в памяти и сбрасывается
+# в базу раз в STATS_FLUSH_INTERVAL секунд или после STATS_FLUSH_COUNT сообщений
+STATS_FLUSH_INTERVAL = 5
+STATS_FLUSH_COUNT = 1000
+# Настройки SQLite для базы сервера, выполняются на каждом соединении.
+# WAL и synchronous=NORMAL: запись не ждёт синхронизации диска на каждой
+# транзакции, при сбое питания теряются последние транзакции, но не
+# целостность базы. Пустая строка - настройки SQLite по умолчанию.
+SQLITE_PRAGMAS = 'journal_mode=WAL,synchronous=NORMAL,mmap_size=268435456,cache_size=-65536,temp_store=MEMORY'
+# Сколько заданий поток базы данных выполняет в одной транзакции
+DB_BATCH = 100
+# Очередь потока базы, начиная с которой новые входы ждут её разбора
+DB_QUEUE_LIMIT = 1000
+# Сколько записей пользователей сервер держит в кэше справочника
+USER_CACHE_SIZE = 10000
+# Порт HTTP сервера метрик на 127.0.0.1, 0 - не запускать. Воркеры
+# кластера слушают порты metrics_port + номер воркера.
+METRICS_PORT = 0
+# Клиент: время ожидания ответа на запрос, секунд
+REQUEST_TIMEOUT = 5
+# Клиент: наибольшая случайная задержка синхронизации справочников
+# после уведомления 205, секунд
+SYNC_JITTER = 3
 # Кодировка проекта
 ENCODING = 'utf-8'
 
@@ -31,6 +80,27 @@ REMOVE_CONTACT = 'remove'
 ADD_CONTACT = 'add'
 USERS_REQUEST = 'get_users'
 PUBLIC_KEY_REQUEST = 'pubkey_need'
+OFFLINE = 'offline'
+ACK = 'ack'
+MESSAGE_ID = 'msg_id'
+ROOM = 'room'
+ROOM_CREATE = 'room_create'
+ROOM_JOIN = 'room_join'
+ROOM_LEAVE = 'room_leave'
+ROOM_MESSAGE = 'room_message'
+ROOMS_REQUEST = 'get_rooms'
+SYNC = 'sync'
+VERSION = 'version'
+ADDED = 'added'
+REMOVED = 'removed'
+FULL = 'full'
+# Номер запроса клиента, копируется сервером в ответ
+REQUEST_ID = 'req_id'
+# Возможности клиента, объявляемые в presence
+CAPABILITIES = 'caps'
+CAP_BINARY = 'binary'
+CAP_ZLIB = 'zlib'
+CAPABILITIES_SUPPORTED = (CAP_BINARY, CAP_ZLIB)
 
 # Словари - ответы:
 # 200
@@ -1,6 +1,9 @@
+import functools
 import logging
+import os
 import sys
 
+from common.variables import ACTION, PRESENCE
 from log import client_log_config, server_log_config
 
 
@@ -9,49 +12,51 @@ if sys.argv[0].find('messenger.client') == -1:
 else:
     logger = logging.getLogger('messenger.client')
 
+# Обёртка @log вокруг функций. Её можно убрать совсем, и тогда
+# декорированная функция вызывается напрямую: запуск python -O или
+# переменная окружения MESSENGER_LOG_CALLS=0.
+LOG_CALLS = __debug__ and os.environ.get('MESSENGER_LOG_CALLS', '1') != '0'
+
 
 def log(func_to_log):
-    def log_saver(*args , **kwargs):
-        logger.debug(f'Была вызвана функция {func_to_log.__name__} c параметрами {args} , {kwargs}. Вызов из модуля {func_to_log.__module__}')
-        ret = func_to_log(*args , **kwargs)
-        return ret
+    if not LOG_CALLS:
+        return func_to_log
+
+    @functools.wraps(func_to_log)
+    def log_saver(*args, **kwargs):
+        # Аргументы форматируются, только если уровень DEBUG включён
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Была вызвана функция %s c параметрами %s , %s. Вызов из модуля %s',
+                         func_to_log.__name__, args, kwargs, func_to_log.__module__)
+        return func_to_log(*args, **kwargs)
     return log_saver
 
 
 def login_required(func):
     """
     Декоратор, проверяющий, что клиент авторизован на сервере.
-    Проверяет, что передаваемый объект сокета находится в
-    списке авторизованных клиентов.
+    Проверяет, что передаваемый объект сокета зарегистрирован
+    в таблице подключений сервера как авторизованный.
     За исключением передачи словаря-запроса
     на авторизацию. Если клиент не авторизован,
     генерирует исключение TypeError
     """
 
     def checker(*args, **kwargs):
-        # проверяем, что первый аргумент - экземпляр MessageProcessor
-        # Импортить необходимо тут, иначе ошибка рекурсивного импорта.
-        from server.core import MessageProcessor
-        from common.variables import ACTION, PRESENCE
-        if isinstance(args[0], MessageProcessor):
-            found = False
-            for arg in args:
-                if isinstance(arg, socket.socket):
-                    # Проверяем, что данный сокет есть в списке names класса
-                    # MessageProcessor
-                    for client in args[0].names:
-                        if args[0].names[client] == arg:
-                            found = True
-
-            # Теперь надо проверить, что передаваемые аргументы не presence
-            # сообщение. Если presence, то разрешаем
-            for arg in args:
+        # проверяем, что у первого аргумента (MessageProcessor) есть
+        # таблица подключений (ConnectionRegistry). Поиск сокета в ней - O(1).
+        authorized = getattr(getattr(args[0], 'names', None), 'authorized', None)
+        if authorized is not None:
+            for arg in args[1:]:
+                # presence сообщение разрешено без авторизации
                 if isinstance(arg, dict):
-                    if ACTION in arg and arg[ACTION] == PRESENCE:
-                        found = True
-            # Если не не авторизован и не сообщение начала авторизации, то
-            # вызываем исключение.
-            if not found:
+                    if arg.get(ACTION) == PRESENCE:
+                        break
+                elif authorized(arg):
+                    break
+            else:
+                # Если не не авторизован и не сообщение начала авторизации, то
+                # вызываем исключение.
                 raise TypeError
         return func(*args, **kwargs)
 
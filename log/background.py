@@ -0,0 +1,60 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+class LightQueueHandler(QueueHandler):
+    """
+    Обработчик, передающий записи журнала в очередь. В вызывающем потоке
+    собирается только текст сообщения (аргументы могут измениться после
+    вызова), полное форматирование и запись в файл - в потоке
+    QueueListener. Как и в QueueHandler.prepare, в очередь уходит копия
+    записи: остальные обработчики (например, при передаче записи
+    родительским логгерам) получают её без изменений.
+    """
+
+    def prepare(self, record):
+        # То же, что copy.copy(record), без медленного общего пути copy
+        original, record = record, object.__new__(type(record))
+        record.__dict__.update(original.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class BackgroundListener(QueueListener):
+    """QueueListener, который помнит, запущен ли он: повторный stop ничего не делает."""
+    running = False
+
+    def start(self):
+        super().start()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            super().stop()
+
+
+def stop_listener(listener):
+    """Останавливает поток записи, дописав очередь. Повторный вызов ничего не делает."""
+    listener.stop()
+
+
+def write_in_background(logger, handler):
+    """
+    Подключает handler к logger через очередь: сетевой поток только
+    кладёт записи в очередь, в файл их пишет отдельный поток.
+    @return: запущенный BackgroundListener
+    """
+    log_queue = queue.SimpleQueue()
+    listener = BackgroundListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    # При выходе дописываем всё, что осталось в очереди
+    atexit.register(stop_listener, listener)
+    logger.addHandler(LightQueueHandler(log_queue))
+    return listener
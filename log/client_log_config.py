@@ -1,6 +1,8 @@
 import logging
 import os
 
+from log.background import write_in_background
+
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 logfile = os.path.join(PATH, 'client.log')
@@ -11,7 +13,8 @@ client_handler.setFormatter(FORMAT)
 client_handler.setLevel(logging.INFO)
 
 logger = logging.getLogger('messenger.client')
-logger.addHandler(client_handler)
+# Запись в файл идёт в отдельном потоке
+listener = write_in_background(logger, client_handler)
 logger.setLevel(logging.INFO)
 
 if __name__ == '__main__':